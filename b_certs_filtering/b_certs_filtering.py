@@ -1,73 +1,202 @@
 import asyncio
-import tldextract
-from dictionary.skippable_subdomains import get_skippable
-from dictionary.domain_tld import get_tld_blacklist
-from db_manager.db_manager import DBManager
+import os
+from concurrent.futures import ThreadPoolExecutor
+import struct
+import time
+import pymysql
+from dotenv import load_dotenv
+from dictionary.lookup_tables import skippable_subdomains_set, tld_blacklist_set
+from db_manager.bloom_filter import ScalableBloomFilter
+from db_manager.async_db_manager import create_db_manager
+from b_certs_filtering.parsed_domain import parse_domain
+from pipeline_queues.batch_records import DomainBatch
+
+# Load environment variables from the .env file at the root of the app
+load_dotenv()
 
 class BCertsFiltering:
-    def __init__(self, queue_bc):
+    def __init__(self, queue_bc, recent_domains_cache=None, db_manager=None):
         self.queue_bc = queue_bc
-        self.db_manager = DBManager()
-        self.db_manager.init_connection()
+        # Optional RecentDomainsCache dropping repeats before the database
+        self.recent_domains_cache = recent_domains_cache
+        # Optional shared database manager (see create_db_manager), so every stage
+        # uses the same connection pool. Its queries are awaited, in-flight batches
+        # run them concurrently, one pooled connection each.
+        self.db_manager = db_manager or create_db_manager()
         self.loop = asyncio.get_running_loop()
+        self.inflight_batches = asyncio.Semaphore(int(os.getenv("FILTER_MAX_INFLIGHT_BATCHES", "4")))
+        self.inflight_tasks = set()
 
-    def filter(self, domains_to_filter):
-        domains_filtered = self._filter_multidomains(domains_to_filter)
-        domains_filtered = self._filter_restricted_tlds(domains_filtered)
-        domains_filtered = self._filter_wildcard_and_duplicates(domains_filtered)
-        domains_filtered = self._filter_service_based_subdomains(domains_filtered)
-        inserted_domains_ids = self._filter_duplicates(domains_filtered)
-        if inserted_domains_ids is not None and len(inserted_domains_ids) > 0:
-            self.queue_bc.put_nowait(inserted_domains_ids)
+        # Bloom filter of domains already stored, used to skip the database
+        # round trip for domains that are definitely new. Loaded in start(),
+        # or warmed from the domains table in the background while filtering
+        # runs. It is only touched on the event loop; file reads and writes
+        # run on a dedicated thread.
+        self.bloom_path = os.getenv("BLOOM_FILTER_PATH", "known_domains.bloom")
+        self.bloom_save_interval = float(os.getenv("BLOOM_FILTER_SAVE_INTERVAL", "300"))
+        self.bloom_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="b_certs_filtering_bloom")
+        self.known_domains = None
+        self.known_domains_complete = False  # False until the warm-up finished, never saved before
+        self.warmup_task = None
+        self.bloom_saved_at = time.time()
 
-    # Multi-level subdomain filter
-    def _filter_multidomains(self, domains_in):
-        domains_out = []
-        for domain in domains_in:
-            subdomain_parts = tldextract.extract(domain).subdomain.split('.')
-            if len(subdomain_parts) <= 1:
-                domains_out.append(domain)
-        return domains_out
+        # Load-once frozensets used by the predicates
+        self.skippable_tlds = tld_blacklist_set()
+        self.skippable_subdomains = skippable_subdomains_set()
 
-    # Restricted TLDs filter
-    def _filter_restricted_tlds(self, domains_in):
-        domains_out = []
-        skippable_tlds = get_tld_blacklist()
-        for domain in domains_in:
-            tld_part = tldextract.extract(domain).suffix.lower()
-            if tld_part not in skippable_tlds:
-                domains_out.append(domain)
-        return domains_out
-    
-    def _filter_wildcard_and_duplicates(self, domains_in):
+        # Chain of predicates applied to every parsed domain, in order.
+        # A domain is kept only if all of them return True.
+        self.predicates = [
+            self._is_single_level,
+            self._is_allowed_tld,
+            self._is_not_service_subdomain,
+        ]
+
+    async def start(self):
+        """
+        Open the database connection pool and load the known domains bloom filter.
+        Returns without waiting for a warm-up from the domains table, so filtering
+        starts right away.
+        """
+        await self.db_manager.init_connection()
+        self.known_domains = await self._load_known_domains()
+
+    async def submit(self, domains_to_filter):
         """
-        Filter out domains starting with '*.' and remove duplicates.
-        Returns the list of cleaned domains and the count of filtered items.
+        Schedule a batch for filtering without waiting for its database work.
+        Waits only while FILTER_MAX_INFLIGHT_BATCHES batches are already in flight.
         """
-        unique_domains = set()
+        await self.inflight_batches.acquire()
+        task = self.loop.create_task(self.filter(domains_to_filter))
+        self.inflight_tasks.add(task)
+        task.add_done_callback(self._on_batch_done)
+
+    def _on_batch_done(self, task):
+        self.inflight_tasks.discard(task)
+        self.inflight_batches.release()
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error filtering batch: {task.exception()}")
+
+    async def filter(self, domains_to_filter):
+        domains_filtered = self._filter_parsed(domains_to_filter)
+        if self.recent_domains_cache is not None:
+            domains_filtered = self.recent_domains_cache.filter_unseen(domains_filtered)
+        if not domains_filtered:
+            return
+        # The domains were recorded as seen up front, so repeats arriving while this
+        # batch is in flight are dropped. If they could not be stored, forget them
+        # again: dropping their repeats for the whole TTL would lose them.
+        try:
+            inserted_domains_ids = await self._filter_duplicates(domains_filtered)
+        except BaseException:
+            self._forget_recent(domains_filtered)
+            raise
+        if inserted_domains_ids is None:
+            self._forget_recent(domains_filtered)
+        elif len(inserted_domains_ids) > 0:
+            await self.queue_bc.put(DomainBatch.from_mapping(inserted_domains_ids))
+
+    def _forget_recent(self, domains):
+        if self.recent_domains_cache is not None:
+            self.recent_domains_cache.forget(domains)
+
+    def _filter_parsed(self, domains_in):
+        """
+        Parse every domain once and run it through the predicate chain.
+        Wildcard and 'www.' prefixes are stripped during parsing, and
+        the resulting hosts are deduplicated.
+        Returns the list of normalized hosts that passed all predicates.
+        """
+        domains_out = {}
         for domain in domains_in:
-            if domain.startswith('*.'):
-                domain = domain[2:]
-            if domain.startswith('www.'):
-                domain = domain[4:]
-            unique_domains.add(domain)
-        return list(unique_domains)
+            parsed = parse_domain(domain)
+            if parsed.host in domains_out:
+                continue
+            if all(predicate(parsed) for predicate in self.predicates):
+                domains_out[parsed.host] = None
+        return list(domains_out)
+
+    # Multi-level subdomain filter
+    def _is_single_level(self, parsed):
+        return parsed.subdomain_depth <= 1
+
+    # Restricted TLDs filter
+    def _is_allowed_tld(self, parsed):
+        return parsed.suffix.lower() not in self.skippable_tlds
 
     # Service-based subdomains filter
-    def _filter_service_based_subdomains(self, domains_in):
-        domains_out = []
-        skippable_subdomains = get_skippable()
-        for domain in domains_in:
-            subdomain_part = tldextract.extract(domain).subdomain.lower()
-            if subdomain_part not in skippable_subdomains:
-                domains_out.append(domain)
-        return domains_out
+    def _is_not_service_subdomain(self, parsed):
+        return parsed.subdomain.lower() not in self.skippable_subdomains
 
-    # Filter duplicates via database (synchronously now)
-    def _filter_duplicates(self, domains_in):
+    async def _load_known_domains(self):
         """
-        Check duplicates by querying the database synchronously.
-        Returns a dictionary of domains (keys) and their corresponding ids in the database (values).
+        Load the known domains bloom filter from disk, or start warming an empty
+        one from the domains table in the background when no usable file exists.
+        A stale or partially warmed filter is safe: domains missing from it are
+        treated as new and still go through INSERT IGNORE.
+        """
+        if self.bloom_path and os.path.exists(self.bloom_path):
+            try:
+                known_domains = await self.loop.run_in_executor(
+                    self.bloom_executor, ScalableBloomFilter.load, self.bloom_path
+                )
+                print(f"Loaded {len(known_domains)} known domains from {self.bloom_path}.")
+                self.known_domains_complete = True
+                return known_domains
+            except (OSError, ValueError, struct.error) as e:
+                print(f"Error loading bloom filter from {self.bloom_path}: {e}")
+
+        known_domains = ScalableBloomFilter(
+            initial_capacity=int(os.getenv("BLOOM_FILTER_CAPACITY", "10000000")),
+            error_rate=float(os.getenv("BLOOM_FILTER_ERROR_RATE", "0.001")),
+        )
+        # Scanning a large table takes minutes, queue_ab must keep draining meanwhile
+        self.warmup_task = self.loop.create_task(self._warm_known_domains(known_domains))
+        return known_domains
+
+    async def _warm_known_domains(self, known_domains):
+        """
+        Add every domain of the domains table to the live bloom filter, then save it.
+        """
+        try:
+            async for domain in self.db_manager.iter_domains():
+                known_domains.add(domain)
+        except pymysql.MySQLError:
+            # A partial filter still saves round trips, but saving it would make
+            # every later start load it and never scan the table again
+            print(f"Bloom filter warm-up did not finish, using {len(known_domains)} known domains without saving.")
+            return
+        except Exception as e:
+            print(f"Error warming bloom filter: {e}")
+            return
+        print(f"Warmed bloom filter with {len(known_domains)} known domains.")
+        self.known_domains_complete = True
+        self.bloom_saved_at = time.time()
+        snapshot = known_domains.copy()
+        known_domains.dirty = False
+        await self._save_known_domains(snapshot)
+
+    async def _save_known_domains(self, known_domains):
+        """
+        Write a bloom filter to disk on the bloom thread.
+        The filter must not change while it is written, pass a copy() of a live one.
+        """
+        if not self.bloom_path:
+            return
+        try:
+            await self.loop.run_in_executor(self.bloom_executor, known_domains.save, self.bloom_path)
+        except OSError as e:
+            print(f"Error saving bloom filter to {self.bloom_path}: {e}")
+
+    # Filter duplicates via database
+    async def _filter_duplicates(self, domains_in):
+        """
+        Check duplicates by awaiting the database.
+        Several in-flight batches may run it at once.
+        Domains the bloom filter has never seen go straight to insert; the
+        ones it has probably seen are checked against the database in batch.
+        Returns a dictionary of domains (keys) and their corresponding ids in the database (values),
+        or None if the insert failed.
         """
         # Filter out any empty or None values from domains_in
         valid_domains = [domain for domain in domains_in if domain]
@@ -76,6 +205,36 @@ class BCertsFiltering:
         if not valid_domains:
             return {}
 
-        # Use the async_to_sync helper to run the async method
-        inserted_domains_ids = self.db_manager.insert_non_duplicates(valid_domains)
-        return inserted_domains_ids
\ No newline at end of file
+        new_domains = []
+        probably_seen = []
+        for domain in valid_domains:
+            if domain in self.known_domains:
+                probably_seen.append(domain)
+            else:
+                new_domains.append(domain)
+
+        # Bloom filter hits may be false positives, confirm them in one batch
+        if probably_seen:
+            duplicate_flags = await self.db_manager.find_duplicates(probably_seen)
+            for domain, is_duplicate in zip(probably_seen, duplicate_flags):
+                if is_duplicate:
+                    self.known_domains.add(domain)
+                else:
+                    new_domains.append(domain)
+
+        inserted_domains_ids = {}
+        if new_domains:
+            inserted_domains_ids = await self.db_manager.insert_non_duplicates(new_domains)
+            if inserted_domains_ids is not None:
+                # Inserted or skipped by INSERT IGNORE, every one of them is stored now.
+                # Adding the skipped ones lets a partial or stale filter catch up.
+                self.known_domains.update(new_domains)
+
+        if self.known_domains_complete and self.known_domains.dirty and time.time() - self.bloom_saved_at >= self.bloom_save_interval:
+            self.bloom_saved_at = time.time()
+            # Save a snapshot, other batches keep adding to the live filter meanwhile
+            snapshot = self.known_domains.copy()
+            self.known_domains.dirty = False
+            await self._save_known_domains(snapshot)
+
+        return inserted_domains_ids
@@ -0,0 +1,57 @@
+"""
+Parsed representation of a certificate domain.
+Each domain coming from certstream is run through tldextract exactly
+once, and the resulting record is handed to every filter predicate,
+so adding filters does not add parsing cost.
+"""
+
+import tldextract
+
+
+class ParsedDomain:
+    __slots__ = ("raw", "host", "subdomain", "subdomain_depth", "registered_domain", "suffix")
+
+    def __init__(self, raw, host, subdomain, subdomain_depth, registered_domain, suffix):
+        self.raw = raw                              # Domain as received in the certificate
+        self.host = host                            # Domain without the '*.' and 'www.' prefixes
+        self.subdomain = subdomain                  # Subdomain part of the normalized host
+        self.subdomain_depth = subdomain_depth      # Number of subdomain labels in the raw domain
+        self.registered_domain = registered_domain  # Domain + suffix, e.g. 'example.co.uk'
+        self.suffix = suffix                        # Public suffix, e.g. 'co.uk'
+
+    def __repr__(self):
+        return f"ParsedDomain(host={self.host!r}, subdomain={self.subdomain!r}, suffix={self.suffix!r})"
+
+
+def parse_domain(raw):
+    """
+    Parses a raw certificate domain into a ParsedDomain.
+    The wildcard ('*.') and 'www.' prefixes are stripped from the host,
+    and the subdomain is adjusted accordingly without parsing twice.
+    :param raw: Domain as found in the certificate's all_domains list.
+    :return: ParsedDomain instance.
+    """
+    extracted = tldextract.extract(raw)
+    subdomain_labels = extracted.subdomain.split('.') if extracted.subdomain else []
+    subdomain_depth = len(subdomain_labels)
+
+    host = raw
+    if host.startswith('*.'):
+        host = host[2:]
+        if subdomain_labels and subdomain_labels[0] == '*':
+            subdomain_labels = subdomain_labels[1:]
+    if host.startswith('www.'):
+        host = host[4:]
+        if subdomain_labels and subdomain_labels[0] == 'www':
+            subdomain_labels = subdomain_labels[1:]
+
+    registered_domain = f"{extracted.domain}.{extracted.suffix}" if extracted.domain and extracted.suffix else ""
+
+    return ParsedDomain(
+        raw=raw,
+        host=host,
+        subdomain='.'.join(subdomain_labels),
+        subdomain_depth=subdomain_depth,
+        registered_domain=registered_domain,
+        suffix=extracted.suffix,
+    )
@@ -0,0 +1,66 @@
+"""
+Bounded cache of recently seen domains.
+Certstream repeats the same SAN lists within minutes (CT logs mirror each
+other, precert and final cert arrive as a pair), so domains seen inside
+the time window are dropped before they reach the database.
+Memory is bounded by max_size, evicting the least recently seen domain.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class RecentDomainsCache:
+    def __init__(self, max_size=100000, ttl=600):
+        """
+        :param max_size: Maximum number of domains kept in the cache.
+        :param ttl: Seconds a domain is considered recent after it was last seen.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # domain -> expiry time
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, domain):
+        """
+        Checks whether domain was seen inside the window, and records it as seen.
+        :param domain: Normalized domain.
+        :return: True if the domain is a recent repeat.
+        """
+        now = time.monotonic()
+        expires_at = self.entries.get(domain)
+        is_recent = expires_at is not None and expires_at > now
+
+        self.entries[domain] = now + self.ttl
+        self.entries.move_to_end(domain)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+        if is_recent:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return is_recent
+
+    def filter_unseen(self, domains):
+        """
+        Returns the domains that were not seen inside the window, recording all of them.
+        """
+        return [domain for domain in domains if not self.seen(domain)]
+
+    def forget(self, domains):
+        """
+        Removes domains from the cache, so their next repeat is processed again.
+        Used when the domains could not be stored.
+        """
+        for domain in domains:
+            self.entries.pop(domain, None)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,147 @@
+"""
+Adaptive concurrency limit for upstream DNS queries.
+A fixed limit is either too low when the upstream is fast or too high
+when it degrades and starts rate limiting. This limiter follows the
+Gradient2 approach: it compares a short-term RTT average to a long-term
+baseline, grows the limit while latency stays flat, shrinks it when
+latency inflates, and backs off multiplicatively on errors.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from c_dns_multiplexer.resolver_backends import DNSResolverBackend
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial_limit=100, min_limit=10, max_limit=1000, smoothing=0.2,
+                 tolerance=1.5, backoff=0.9, short_window=10, long_window=600):
+        """
+        :param initial_limit: Starting concurrency limit.
+        :param min_limit: Lowest the limit can go.
+        :param max_limit: Highest the limit can go.
+        :param smoothing: Weight of each new limit estimate.
+        :param tolerance: RTT inflation tolerated before the limit shrinks (1.5 = +50%).
+        :param backoff: Multiplier applied to the limit on errors.
+        :param short_window: Samples in the short-term RTT average.
+        :param long_window: Round trips in the long-term RTT baseline.
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.short_alpha = 2 / (short_window + 1)
+        self.long_alpha = 2 / (long_window + 1)
+        self.short_rtt = None
+        self.long_rtt = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.waiters = deque()
+        self.next_update_at = 0.0
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                raise
+        self.in_flight += 1
+
+    def release(self, rtt=None, error=False):
+        """
+        Frees a slot and feeds the outcome to the limit.
+        :param rtt: Round trip time of a successful query, in seconds.
+        :param error: True if the query failed or timed out.
+        """
+        self.in_flight -= 1
+        if error:
+            self._on_error()
+        elif rtt is not None:
+            self._on_sample(rtt)
+        self._wake_waiters()
+
+    def _on_error(self):
+        self.error_rate += self.short_alpha * (1.0 - self.error_rate)
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def _on_sample(self, rtt):
+        self.error_rate -= self.short_alpha * self.error_rate
+        if self.short_rtt is None:
+            self.short_rtt = self.long_rtt = rtt
+            return
+        self.short_rtt += self.short_alpha * (rtt - self.short_rtt)
+
+        # Adapt once per round trip, so the effect of the previous change shows up
+        # in the RTT before the next one, whatever the query rate
+        now = time.monotonic()
+        if now < self.next_update_at:
+            return
+        self.next_update_at = now + self.short_rtt
+
+        # The baseline stands for the no-load RTT: it follows improvements quickly
+        # and rises slowly, otherwise our own queueing would become the baseline
+        if self.short_rtt < self.long_rtt:
+            self.long_rtt += 10 * self.long_alpha * (self.short_rtt - self.long_rtt)
+        else:
+            self.long_rtt += self.long_alpha * (self.short_rtt - self.long_rtt)
+
+        # Only move the limit while it is actually being used
+        if self.in_flight < self.limit / 2:
+            return
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / self.short_rtt))
+        queue_size = math.sqrt(self.limit)
+        new_limit = self.limit * gradient + queue_size
+        new_limit = self.limit * (1 - self.smoothing) + new_limit * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, new_limit))
+
+    def _wake_waiters(self):
+        available = int(self.limit) - self.in_flight
+        while available > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                available -= 1
+
+    def stats(self):
+        return {
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "rtt_short_ms": round((self.short_rtt or 0) * 1000, 1),
+            "rtt_long_ms": round((self.long_rtt or 0) * 1000, 1),
+            "error_rate": round(self.error_rate, 4),
+        }
+
+
+class LimitedBackend(DNSResolverBackend):
+    """Resolver backend sending queries through an AdaptiveLimiter."""
+
+    def __init__(self, backend, limiter):
+        self.backend = backend
+        self.limiter = limiter
+
+    async def start(self):
+        await self.backend.start()
+
+    async def close(self):
+        await self.backend.close()
+
+    async def query(self, name, record_type):
+        await self.limiter.acquire()
+        started_at = time.monotonic()
+        try:
+            response = await self.backend.query(name, record_type)
+        except asyncio.CancelledError:
+            self.limiter.release()
+            raise
+        except Exception:
+            self.limiter.release(error=True)
+            raise
+        self.limiter.release(rtt=time.monotonic() - started_at)
+        return response
@@ -1,106 +1,308 @@
-import aiohttp
 import asyncio
-import json
+import heapq
+import os
+import random
 import re
 import time
+from b_certs_filtering.parsed_domain import parse_domain
+from c_dns_multiplexer.adaptive_limiter import AdaptiveLimiter, LimitedBackend
+from c_dns_multiplexer.dns_cache import CachingBackend, DNSAnswerCache
+from c_dns_multiplexer.dns_wire import RCODE_SERVFAIL
+from c_dns_multiplexer.resilience import OPEN, CircuitBreaker, CircuitBreakerBackend, RetryingBackend
+from c_dns_multiplexer.resolver_backends import DNSQueryError, create_backends_from_env
+from c_dns_multiplexer.upstream_pool import UpstreamPool
+from c_dns_multiplexer.zone_ns_cache import ZoneNameserverCache
+from pipeline_queues.batch_records import EnrichedBatch
 
-class CDNSMultiplexer:
-    DOH_URL = "https://cloudflare-dns.com/dns-query"
-
-    def __init__(self, semaphore_limit=500):
-        # Limit concurrent DNS resolution requests
-        self.semaphore = asyncio.Semaphore(semaphore_limit)
-        self.session = None  # Will hold a reusable session for all requests
+# Host names inside SOA data ('mname rname serial refresh retry expire minimum')
+NS_REGEX = re.compile(r"([a-zA-Z0-9-]+\.[a-zA-Z0-9.-]+\.)")
 
-    async def init_session(self):
-        """Initialize the aiohttp session for DNS queries."""
-        self.session = aiohttp.ClientSession()
-
-    async def close_session(self):
-        """Close the aiohttp session."""
-        if self.session:
-            await self.session.close()
+class CDNSMultiplexer:
+    def __init__(self, num_workers=500, pending_size=1000, enriched_counter=None, backend=None):
+        # Fixed pool of long-lived resolver workers pulling from an internal queue.
+        # The queue is bounded, so submit() blocks when the workers fall behind,
+        # which pushes back onto queue_bc instead of piling up tasks.
+        self.num_workers = num_workers
+        self.pending = asyncio.Queue(maxsize=pending_size)
+        self.workers = []
+        self.queue_cd = None
+        self.enriched_counter = enriched_counter
+        # Resolver backend (DoH JSON by default, see DNS_BACKEND). Several upstreams
+        # are load balanced by latency, with hedged requests for slow queries.
+        self.upstream_pool = None
+        self.breakers = {}
+        if backend is None:
+            # One circuit breaker per upstream, so a dead upstream fails fast
+            backends = []
+            for upstream in create_backends_from_env():
+                breaker = CircuitBreaker(
+                    failure_threshold=int(os.getenv("DNS_BREAKER_FAILURES", "5")),
+                    reset_timeout=float(os.getenv("DNS_BREAKER_RESET_S", "30")),
+                )
+                self.breakers[upstream.name] = breaker
+                backends.append(CircuitBreakerBackend(upstream, breaker))
+            if len(backends) > 1:
+                backend = self.upstream_pool = UpstreamPool(
+                    backends,
+                    hedge=os.getenv("DNS_HEDGE", "1") == "1",
+                    hedge_quantile=float(os.getenv("DNS_HEDGE_QUANTILE", "0.95")),
+                    min_hedge_delay=int(os.getenv("DNS_HEDGE_MIN_DELAY_MS", "10")) / 1000,
+                )
+            else:
+                backend = backends[0]
+        elif isinstance(backend, UpstreamPool):
+            self.upstream_pool = backend
+        # Adaptive limit on concurrent upstream queries, grown while latency is
+        # flat and cut back on errors or latency inflation
+        self.limiter = AdaptiveLimiter(
+            initial_limit=int(os.getenv("DNS_CONCURRENCY_INITIAL", "100")),
+            min_limit=int(os.getenv("DNS_CONCURRENCY_MIN", "10")),
+            max_limit=int(os.getenv("DNS_CONCURRENCY_MAX", "1000")),
+        )
+        self.backend = LimitedBackend(backend, self.limiter)
+        # Retryable failures and SERVFAIL answers are retried with jittered backoff
+        self.retrying_backend = self.backend = RetryingBackend(
+            self.backend,
+            attempts=int(os.getenv("DNS_RETRY_ATTEMPTS", "3")),
+            base_delay=int(os.getenv("DNS_RETRY_BASE_DELAY_MS", "100")) / 1000,
+            max_delay=int(os.getenv("DNS_RETRY_MAX_DELAY_MS", "2000")) / 1000,
+        )
+        # TTL-aware answer cache in front of the backend (disabled with DNS_CACHE_SIZE=0)
+        self.answer_cache = None
+        cache_size = int(os.getenv("DNS_CACHE_SIZE", "200000"))
+        if cache_size > 0:
+            self.answer_cache = DNSAnswerCache(
+                max_size=cache_size,
+                max_ttl=int(os.getenv("DNS_CACHE_MAX_TTL", "3600")),
+                negative_ttl=int(os.getenv("DNS_CACHE_NEGATIVE_TTL", "300")),
+                servfail_ttl=int(os.getenv("DNS_CACHE_SERVFAIL_TTL", "30")),
+            )
+            self.backend = CachingBackend(self.backend, self.answer_cache)
+        # Nameservers of non-delegated subdomains, shared by every sibling of the zone
+        self.zone_nameservers = ZoneNameserverCache(
+            max_size=int(os.getenv("DNS_ZONE_NS_CACHE_SIZE", "100000")),
+            ttl=float(os.getenv("DNS_ZONE_NS_TTL", "3600")),
+        )
+        # Domains whose lookup still failed after the retries are requeued later
+        # instead of being emitted without IPs. After DNS_MAX_REQUEUES (or when the
+        # retry queue is full) they are emitted with empty results, never lost.
+        self.retry_queue = []  # Heap of (due time, sequence, domain id, domain, requeues)
+        self.retry_queue_size = int(os.getenv("DNS_RETRY_QUEUE_SIZE", "100000"))
+        self.max_requeues = int(os.getenv("DNS_MAX_REQUEUES", "3"))
+        self.requeue_delay = float(os.getenv("DNS_REQUEUE_DELAY_S", "60"))
+        self.retry_sequence = 0
+        self.retry_task = None
+        self.requeued = 0
+        self.unresolved = 0
+        # Results are handed to queue_cd as EnrichedBatch records, flushed when
+        # full or DNS_RESULT_BATCH_MAX_DELAY_MS after the previous flush
+        self.result_batch = EnrichedBatch()
+        self.result_batch_size = int(os.getenv("DNS_RESULT_BATCH_SIZE", "200"))
+        self.result_batch_max_delay = int(os.getenv("DNS_RESULT_BATCH_MAX_DELAY_MS", "200")) / 1000
+        self.flush_task = None
 
     async def async_dns_resolve(self, domain):
         """
-        Resolves IP and NS for a given domain asynchronously using Cloudflare DoH.
+        Resolves IP and NS for a given domain asynchronously using the configured backend.
+        A and NS are queried concurrently. For subdomains whose zone nameservers
+        are already cached, only the A query is sent and the zone's nameservers
+        are returned, even if the subdomain is delegated (see ZoneNameserverCache).
+        :raises DNSQueryError: If the lookup failed in a way worth retrying later.
         """
         try:
-            ip_url = f"{self.DOH_URL}?name={domain}&type=A"
-            ns_url = f"{self.DOH_URL}?name={domain}&type=NS"
-            headers = {"accept": "application/dns-json"}
-
-            async with self.semaphore:
-                async with self.session.get(ip_url, headers=headers) as ip_response, \
-                           self.session.get(ns_url, headers=headers) as ns_response:
-                    
-                    if ip_response.status == 200 and ns_response.status == 200:
-                        ip_raw = await ip_response.text()
-                        ns_raw = await ns_response.text()
-
-                        # Parse IP response
-                        ip_data = json.loads(ip_raw)
-                        ips = [answer['data'] for answer in ip_data.get('Answer', []) if answer.get('type') == 1]
-
-                        # Parse NS response to include records from both Answer and Authority sections
-                        ns_data = json.loads(ns_raw)
-                        
-                        # Extract NS records from the response
-                        all_nameservers = self.extract_nameservers(ns_data)
-                        return ips, all_nameservers
-                    else:
-                        return [], []
+            zone = parse_domain(domain).registered_domain
+            is_subdomain = bool(zone) and domain.lower() != zone.lower()
+
+            cached_nameservers = self.zone_nameservers.get(zone) if is_subdomain else None
+            if cached_nameservers is not None:
+                ip_data = await self.backend.query(domain, 'A')
+                self.check_servfail(ip_data)
+                return self.extract_ips(ip_data), list(cached_nameservers)
+
+            ip_data, ns_data = await asyncio.gather(
+                self.backend.query(domain, 'A'),
+                self.backend.query(domain, 'NS'),
+            )
+            self.check_servfail(ip_data)
+            self.check_servfail(ns_data)
+
+            # Extract NS records from both Answer and Authority sections
+            all_nameservers, has_direct_nameservers = self.extract_nameservers(ns_data)
 
+            # A subdomain without its own NS records is answered by its zone,
+            # so the same nameservers apply to all of its siblings
+            if is_subdomain and all_nameservers and not has_direct_nameservers:
+                self.zone_nameservers.put(zone, all_nameservers)
+
+            return self.extract_ips(ip_data), all_nameservers
+
+        except DNSQueryError as e:
+            if e.retryable:
+                raise
+            return [], []
         except Exception as e:
             print(f"DNS Resolution failed for domain {domain}: {e}")
             return [], []
 
-    def extract_nameservers(self, ns_data):
-        """Extract nameservers from NS and SOA records."""
-        direct_nameservers = []
-        authoritative_nameservers = []
-        soa_nameservers = []
+    def check_servfail(self, response):
+        """Raises a retryable DNSQueryError if the upstream could not resolve the name (SERVFAIL)."""
+        if response.get('Status') == RCODE_SERVFAIL:
+            raise DNSQueryError("SERVFAIL")
 
-        ns_regex = re.compile(r"([a-zA-Z0-9-]+\.[a-zA-Z0-9.-]+\.)")
+    def extract_ips(self, ip_data):
+        """Extract IPv4 addresses from A records."""
+        return [answer['data'] for answer in ip_data.get('Answer', ()) if answer.get('type') == 1]
+
+    def extract_nameservers(self, ns_data):
+        """
+        Extract nameservers from NS and SOA records in a single pass.
+        :return: Tuple (list of nameservers, whether the Answer section holds NS records).
+        """
+        nameservers = set()
+        has_direct_nameservers = False
 
-        for answer in ns_data.get('Answer', []):
+        for answer in ns_data.get('Answer', ()):
             if answer.get('type') == 2:  # Direct NS type
-                direct_nameservers.append(answer['data'])
+                nameservers.add(answer['data'])
+                has_direct_nameservers = True
+
+        for authority in ns_data.get('Authority', ()):
+            record_type = authority.get('type')
+            if record_type == 2:  # NS type in Authority section
+                nameservers.add(authority['data'])
+            elif record_type == 6:  # SOA type in Authority section
+                nameservers.update(NS_REGEX.findall(authority['data']))
+
+        return list(nameservers), has_direct_nameservers
+
+    def stats(self):
+        """Returns the multiplexer's counters for reporting."""
+        stats = {
+            "pending": self.pending.qsize(),
+            "zone_ns_cached": len(self.zone_nameservers),
+            "zone_ns_hits": self.zone_nameservers.hits,
+            "zone_ns_misses": self.zone_nameservers.misses,
+        }
+        if self.answer_cache is not None:
+            stats.update({
+                "cache_size": len(self.answer_cache),
+                "cache_hits": self.answer_cache.hits,
+                "cache_negative_hits": self.answer_cache.negative_hits,
+                "cache_misses": self.answer_cache.misses,
+                "cache_evictions": self.answer_cache.evictions,
+                "cache_hit_rate": round(self.answer_cache.hit_rate, 4),
+            })
+        stats.update(self.limiter.stats())
+        stats.update({
+            "retries": self.retrying_backend.retries,
+            "retry_queue": len(self.retry_queue),
+            "requeued": self.requeued,
+            "unresolved": self.unresolved,
+        })
+        if self.breakers:
+            stats["breakers_open"] = sum(1 for breaker in self.breakers.values() if breaker.state == OPEN)
+            stats["breaker_trips"] = sum(breaker.trips for breaker in self.breakers.values())
+        if self.upstream_pool is not None:
+            stats.update(self.upstream_pool.stats())
+        return stats
+
+    async def start(self, queue_cd):
+        """
+        Starts the resolver backend and the resolver workers, which place
+        enriched results in queue_cd.
+        """
+        await self.backend.start()
+        self.queue_cd = queue_cd
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+        self.retry_task = asyncio.create_task(self._retry_loop())
+        self.flush_task = asyncio.create_task(self._flush_loop())
 
-        for authority in ns_data.get('Authority', []):
-            if authority.get('type') == 2:  # NS type in Authority section
-                authoritative_nameservers.append(authority['data'])
-            elif authority.get('type') == 6:  # SOA type in Authority section
-                soa_entries = ns_regex.findall(authority['data'])
-                soa_nameservers.extend(soa_entries)
+    async def stop(self):
+        """Stops the resolver workers, hands over the last results and closes the backend."""
+        tasks = self.workers + [task for task in (self.retry_task, self.flush_task) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers = []
+        self.retry_task = None
+        self.flush_task = None
+        await self.flush_results()
+        await self.backend.close()
 
-        return list(set(direct_nameservers + authoritative_nameservers + soa_nameservers))
+    async def submit(self, domain_id, domain):
+        """
+        Queues a domain for resolution, waiting while the internal queue is full.
+        """
+        await self.pending.put((domain_id, domain, 0))
 
-    async def enrich_domains(self, domains_and_ids, queue_cd):
+    def schedule_retry(self, domain_id, domain, requeues):
         """
-        Resolves DNS for a batch of domains and places enriched results in queue_cd.
+        Puts a domain whose lookup failed in the retry queue.
+        :return: False if it has been requeued max_requeues times or the queue is full.
         """
-        if not self.session:
-            await self.init_session()
+        if requeues >= self.max_requeues or len(self.retry_queue) >= self.retry_queue_size:
+            return False
+        # Exponential delay with jitter, so a burst of failures is not retried in one go
+        delay = self.requeue_delay * 2 ** requeues * random.uniform(0.5, 1.5)
+        self.retry_sequence += 1
+        heapq.heappush(self.retry_queue, (time.monotonic() + delay, self.retry_sequence, domain_id, domain, requeues + 1))
+        self.requeued += 1
+        return True
+
+    async def _retry_loop(self):
+        """Moves requeued domains back to the internal queue once their delay has passed."""
+        while True:
+            now = time.monotonic()
+            while self.retry_queue and self.retry_queue[0][0] <= now:
+                _due, _sequence, domain_id, domain, requeues = heapq.heappop(self.retry_queue)
+                await self.pending.put((domain_id, domain, requeues))
+            await asyncio.sleep(1)
 
-        batch_start_time = time.time()
-        tasks = [self.process_and_enqueue(domain_id, domain, queue_cd) for domain, domain_id in domains_and_ids.items()]
-        await asyncio.gather(*tasks)
-        
-        # Log batch processing time
-        batch_end_time = time.time()
-        print(f"Processed batch of size {len(domains_and_ids)} in {batch_end_time - batch_start_time:.2f} seconds")
+    async def flush_results(self):
+        """Puts the current result batch in queue_cd, if it holds anything."""
+        if not self.result_batch:
+            return
+        batch, self.result_batch = self.result_batch, EnrichedBatch()
+        await self.queue_cd.put(batch)
 
+    async def _flush_loop(self):
+        """Flushes partial result batches, so a slow trickle of domains is not held back."""
+        while True:
+            await asyncio.sleep(self.result_batch_max_delay)
+            await self.flush_results()
 
-    async def process_and_enqueue(self, domain_id, domain, queue_cd):
+    async def _worker(self):
+        """Long-lived worker resolving domains from the internal queue."""
+        while True:
+            domain_id, domain, requeues = await self.pending.get()
+            try:
+                await self.process_and_enqueue(domain_id, domain)
+                if self.enriched_counter is not None:
+                    self.enriched_counter[0] += 1
+            except DNSQueryError:
+                if not self.schedule_retry(domain_id, domain, requeues):
+                    # The domain is already stored: emit it without IPs and NS, so it
+                    # still reaches storage and Pulsar instead of being lost
+                    self.unresolved += 1
+                    await self.add_result(domain_id, domain, [], [])
+                    if self.enriched_counter is not None:
+                        self.enriched_counter[0] += 1
+            except Exception as e:
+                print(f"Failed to enrich domain {domain}: {e}")
+            finally:
+                self.pending.task_done()
+
+    async def process_and_enqueue(self, domain_id, domain):
         """
-        Processes a single domain to enrich with IP and NS data and enqueues the result in queue_cd.
+        Processes a single domain to enrich with IP and NS data and adds the result to the
+        current EnrichedBatch, which is put in queue_cd once full.
+        :raises DNSQueryError: If the lookup should be retried later instead of emitting empty results.
         """
         ips, nameservers = await self.async_dns_resolve(domain)
-        enriched_data = {
-            "id": domain_id,
-            "domain": domain,
-            "ips": ips if ips else [],
-            "ns": nameservers if nameservers else []
-        }
-        await queue_cd.put(enriched_data)
+        await self.add_result(domain_id, domain, ips if ips else [], nameservers if nameservers else [])
+
+    async def add_result(self, domain_id, domain, ips, nameservers):
+        """Adds a result to the current EnrichedBatch, putting it in queue_cd once full."""
+        self.result_batch.append(domain_id, domain, ips, nameservers)
+        if len(self.result_batch) >= self.result_batch_size:
+            await self.flush_results()
@@ -0,0 +1,115 @@
+"""
+TTL-aware DNS answer cache.
+Answers are kept for the smallest TTL of their records. NXDOMAIN and
+empty answers are cached negatively for the zone's SOA minimum, and
+SERVFAIL for a short fixed time, both capped so a bad answer does not
+stick around. Memory is bounded with LRU eviction.
+"""
+
+import time
+from collections import OrderedDict
+from c_dns_multiplexer.dns_wire import RCODE_NOERROR, RCODE_NXDOMAIN, RCODE_SERVFAIL
+from c_dns_multiplexer.resolver_backends import DNSResolverBackend
+
+
+class DNSAnswerCache:
+    def __init__(self, max_size=200000, max_ttl=3600, negative_ttl=300, servfail_ttl=30):
+        """
+        :param max_size: Maximum number of cached answers.
+        :param max_ttl: Upper bound for positive answers, in seconds.
+        :param negative_ttl: Upper bound for NXDOMAIN and empty answers, in seconds.
+        :param servfail_ttl: Time SERVFAIL answers are cached, in seconds.
+        """
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.servfail_ttl = servfail_ttl
+        self.entries = OrderedDict()  # (name, record type) -> (expiry time, response)
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(name, record_type):
+        return name.lower().rstrip('.'), record_type
+
+    def get(self, name, record_type):
+        """
+        :return: Cached response dict, or None.
+        """
+        key = self._key(name, record_type)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        response = entry[1]
+        if response.get('Answer'):
+            self.hits += 1
+        else:
+            self.negative_hits += 1
+        return response
+
+    def put(self, name, record_type, response):
+        ttl = self.ttl_of(response)
+        if ttl <= 0:
+            return
+        key = self._key(name, record_type)
+        self.entries[key] = (time.monotonic() + ttl, response)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def ttl_of(self, response):
+        """Returns how long a response may be cached, in seconds."""
+        status = response.get('Status', RCODE_NOERROR)
+        if status == RCODE_SERVFAIL:
+            return self.servfail_ttl
+        if status not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+            return 0
+
+        answers = response.get('Answer')
+        if status == RCODE_NOERROR and answers:
+            return min(min(answer.get('TTL', 0) for answer in answers), self.max_ttl)
+
+        # NXDOMAIN or NODATA: the SOA in the Authority section bounds negative caching (RFC 2308)
+        negative_ttls = []
+        for authority in response.get('Authority', []):
+            if authority.get('type') == 6:
+                fields = authority.get('data', '').split()
+                soa_minimum = int(fields[6]) if len(fields) == 7 and fields[6].isdigit() else self.negative_ttl
+                negative_ttls.append(min(authority.get('TTL', 0), soa_minimum))
+        return min(min(negative_ttls) if negative_ttls else self.negative_ttl, self.negative_ttl)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return (self.hits + self.negative_hits) / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CachingBackend(DNSResolverBackend):
+    """Resolver backend answering from a DNSAnswerCache before asking the wrapped backend."""
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    async def start(self):
+        await self.backend.start()
+
+    async def close(self):
+        await self.backend.close()
+
+    async def query(self, name, record_type):
+        response = self.cache.get(name, record_type)
+        if response is None:
+            response = await self.backend.query(name, record_type)
+            self.cache.put(name, record_type, response)
+        return response
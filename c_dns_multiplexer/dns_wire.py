@@ -0,0 +1,168 @@
+"""
+Minimal DNS wire format (RFC 1035) encoder and decoder.
+Responses are decoded into the same dict layout Cloudflare returns for
+application/dns-json ('Status', 'TC', 'Answer', 'Authority', records with
+'name', 'type', 'TTL' and 'data'), so every resolver backend can feed the
+same answer extraction code.
+"""
+
+import ipaddress
+import random
+import struct
+
+RECORD_TYPES = {'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'PTR': 12, 'MX': 15, 'TXT': 16, 'AAAA': 28}
+
+# DNS response codes
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+_HEADER = struct.Struct('!HHHHHH')
+_QUESTION_TAIL = struct.Struct('!HH')
+_RECORD_HEADER = struct.Struct('!HHIH')
+
+_FLAG_RD = 0x0100  # Recursion desired
+_FLAG_TC = 0x0200  # Truncated
+_CLASS_IN = 1
+
+
+class DNSWireError(Exception):
+    """Raised when a DNS message cannot be decoded."""
+
+
+def new_query_id():
+    return random.getrandbits(16)
+
+
+def encode_name(name):
+    labels = name.rstrip('.').split('.') if name.strip('.') else []
+    encoded = bytearray()
+    for label in labels:
+        label_bytes = label.encode('idna') if not label.isascii() else label.encode('ascii')
+        if not 0 < len(label_bytes) < 64:
+            raise DNSWireError(f"Invalid label in {name!r}")
+        encoded.append(len(label_bytes))
+        encoded += label_bytes
+    encoded.append(0)
+    return bytes(encoded)
+
+
+def encode_query(name, record_type, query_id=None):
+    """
+    Builds a recursive query for a single question.
+    :param name: Domain to query.
+    :param record_type: Record type name ('A', 'NS', ...).
+    :param query_id: 16-bit message id (random if omitted).
+    :return: The query message as bytes.
+    """
+    if query_id is None:
+        query_id = new_query_id()
+    header = _HEADER.pack(query_id, _FLAG_RD, 1, 0, 0, 0)
+    return header + encode_name(name) + _QUESTION_TAIL.pack(RECORD_TYPES[record_type], _CLASS_IN)
+
+
+def query_id_of(message):
+    """Returns the message id of a raw DNS message."""
+    if len(message) < 2:
+        raise DNSWireError("Message too short")
+    return (message[0] << 8) | message[1]
+
+
+def _decode_name(message, offset):
+    """
+    Decodes a possibly compressed name.
+    :return: Tuple (name with trailing dot, offset after the name).
+    """
+    labels = []
+    end_offset = None
+    jumps = 0
+    while True:
+        if offset >= len(message):
+            raise DNSWireError("Name out of bounds")
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(message):
+                raise DNSWireError("Pointer out of bounds")
+            if end_offset is None:
+                end_offset = offset + 2
+            offset = ((length & 0x3F) << 8) | message[offset + 1]
+            jumps += 1
+            if jumps > 64:
+                raise DNSWireError("Compression loop")
+            continue
+        if length == 0:
+            offset += 1
+            break
+        offset += 1
+        labels.append(message[offset:offset + length].decode('ascii', errors='replace'))
+        offset += length
+    return '.'.join(labels) + '.', (end_offset if end_offset is not None else offset)
+
+
+def _decode_rdata(message, record_type, offset, length):
+    rdata = message[offset:offset + length]
+    if record_type == 1 and length == 4:
+        return str(ipaddress.IPv4Address(rdata))
+    if record_type == 28 and length == 16:
+        return str(ipaddress.IPv6Address(rdata))
+    if record_type in (2, 5, 12):
+        return _decode_name(message, offset)[0]
+    if record_type == 6:
+        mname, next_offset = _decode_name(message, offset)
+        rname, next_offset = _decode_name(message, next_offset)
+        serial, refresh, retry, expire, minimum = struct.unpack_from('!IIIII', message, next_offset)
+        return f"{mname} {rname} {serial} {refresh} {retry} {expire} {minimum}"
+    if record_type == 15:
+        preference = struct.unpack_from('!H', message, offset)[0]
+        return f"{preference} {_decode_name(message, offset + 2)[0]}"
+    return rdata.hex()
+
+
+def _decode_records(message, offset, count):
+    records = []
+    for _ in range(count):
+        name, offset = _decode_name(message, offset)
+        if offset + _RECORD_HEADER.size > len(message):
+            raise DNSWireError("Record out of bounds")
+        record_type, _record_class, ttl, length = _RECORD_HEADER.unpack_from(message, offset)
+        offset += _RECORD_HEADER.size
+        if offset + length > len(message):
+            raise DNSWireError("Record data out of bounds")
+        records.append({
+            'name': name,
+            'type': record_type,
+            'TTL': ttl,
+            'data': _decode_rdata(message, record_type, offset, length),
+        })
+        offset += length
+    return records, offset
+
+
+def decode_response(message):
+    """
+    Decodes a DNS response message.
+    :param message: Raw response bytes.
+    :return: Dict in the application/dns-json layout.
+    """
+    if len(message) < _HEADER.size:
+        raise DNSWireError("Message too short")
+    try:
+        _query_id, flags, qdcount, ancount, nscount, _arcount = _HEADER.unpack_from(message, 0)
+        offset = _HEADER.size
+        for _ in range(qdcount):
+            _name, offset = _decode_name(message, offset)
+            offset += _QUESTION_TAIL.size
+        answers, offset = _decode_records(message, offset, ancount)
+        authority, offset = _decode_records(message, offset, nscount)
+    except (struct.error, ValueError, IndexError) as e:
+        raise DNSWireError(f"Malformed DNS message: {e}") from e
+
+    response = {
+        'Status': flags & 0x000F,
+        'TC': bool(flags & _FLAG_TC),
+    }
+    if answers:
+        response['Answer'] = answers
+    if authority:
+        response['Authority'] = authority
+    return response
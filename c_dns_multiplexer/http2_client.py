@@ -0,0 +1,227 @@
+"""
+Lean HTTP/2 client connection for DNS-over-HTTPS.
+Every request is a stream on one long-lived connection, so hundreds of
+concurrent DoH queries share a single TCP/TLS session instead of opening
+one HTTP/1.1 connection each. Built directly on the h2 state machine and
+asyncio streams to keep per-request overhead low.
+"""
+
+import asyncio
+import ssl
+from urllib.parse import urlsplit
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.errors
+    import h2.events
+    import h2.exceptions
+except ImportError:  # Only needed by DoHWireBackend
+    h2 = None
+
+
+class HTTP2Error(Exception):
+    """Raised when a request fails at the connection or stream level."""
+
+
+class _Stream:
+    __slots__ = ("future", "status", "body")
+
+    def __init__(self, future):
+        self.future = future
+        self.status = None
+        self.body = bytearray()
+
+
+class HTTP2Connection:
+    def __init__(self, url, max_streams=100, ssl_context=None, connect_timeout=None):
+        """
+        :param url: Base URL; https:// negotiates h2 with ALPN, http:// speaks h2 with prior knowledge.
+        :param max_streams: Maximum number of concurrent streams opened on the connection.
+        :param ssl_context: Optional SSL context for https:// URLs.
+        :param connect_timeout: Seconds to wait for the TCP/TLS handshake (no limit if None).
+        """
+        if h2 is None:
+            raise RuntimeError("HTTP2Connection requires the h2 package: pip install h2")
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.authority = parts.netloc
+        self.path = parts.path or "/"
+        self.ssl_context = ssl_context
+        self.connect_timeout = connect_timeout
+        self.streams_limit = asyncio.Semaphore(max_streams)
+        # Set whenever a stream closes, wakes requests waiting for the server's stream limit
+        self.stream_closed = asyncio.Event()
+        self.connect_lock = asyncio.Lock()
+        self.streams = {}
+        self.connection = None
+        self.writer = None
+        self.reader_task = None
+
+    @property
+    def is_open(self):
+        return self.connection is not None
+
+    def _make_ssl_context(self):
+        context = self.ssl_context or ssl.create_default_context()
+        context.set_alpn_protocols(["h2"])
+        return context
+
+    async def connect(self):
+        async with self.connect_lock:
+            if self.is_open:
+                return
+            use_tls = self.scheme == "https"
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(
+                    self.host, self.port,
+                    ssl=self._make_ssl_context() if use_tls else None,
+                    server_hostname=self.host if use_tls else None,
+                ), self.connect_timeout)
+            except asyncio.TimeoutError:
+                raise HTTP2Error(f"Connection to {self.authority} timed out")
+            if use_tls:
+                ssl_object = writer.get_extra_info("ssl_object")
+                if ssl_object is None or ssl_object.selected_alpn_protocol() != "h2":
+                    writer.close()
+                    raise HTTP2Error(f"{self.authority} does not support HTTP/2")
+
+            connection = h2.connection.H2Connection(
+                config=h2.config.H2Configuration(client_side=True, header_encoding=None)
+            )
+            connection.initiate_connection()
+            writer.write(connection.data_to_send())
+            self.connection = connection
+            self.writer = writer
+            self.reader_task = asyncio.create_task(self._read_loop(reader, connection))
+
+    async def close(self):
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.connection is not None:
+            try:
+                self.connection.close_connection()
+                self.writer.write(self.connection.data_to_send())
+            except Exception:
+                pass
+        self._fail_all(HTTP2Error("Connection closed"))
+
+    def _fail_all(self, error):
+        for stream in self.streams.values():
+            if not stream.future.done():
+                stream.future.set_exception(error)
+        self.streams.clear()
+        self.stream_closed.set()
+        if self.writer is not None:
+            self.writer.close()
+        self.connection = None
+        self.writer = None
+
+    async def request(self, method, headers, body=b""):
+        """
+        Sends a request on a new stream.
+        :param method: HTTP method.
+        :param headers: List of (name, value) byte tuples, without pseudo-headers.
+        :param body: Request body.
+        :return: Tuple (status code, response body bytes).
+        """
+        async with self.streams_limit:
+            while True:
+                if not self.is_open:
+                    await self.connect()
+                connection = self.connection
+                try:
+                    stream_id = connection.get_next_available_stream_id()
+                    request_headers = [
+                        (b":method", method),
+                        (b":scheme", self.scheme.encode()),
+                        (b":authority", self.authority.encode()),
+                        (b":path", self.path.encode()),
+                        *headers,
+                        (b"content-length", str(len(body)).encode()),
+                    ]
+                    connection.send_headers(stream_id, request_headers, end_stream=not body)
+                    if body:
+                        connection.send_data(stream_id, body, end_stream=True)
+                    break
+                except h2.exceptions.TooManyStreamsError:
+                    # The server allows fewer concurrent streams than max_streams,
+                    # wait for one of ours to close (the caller's deadline still applies)
+                    self.stream_closed.clear()
+                    await self.stream_closed.wait()
+                except h2.exceptions.NoAvailableStreamIDError:
+                    # Stream ids are exhausted, start over on a fresh connection
+                    await self.close()
+                    raise HTTP2Error("Stream ids exhausted")
+                except h2.exceptions.ProtocolError as e:
+                    raise HTTP2Error(f"Protocol error: {e}") from e
+
+            future = asyncio.get_running_loop().create_future()
+            stream = _Stream(future)
+            self.streams[stream_id] = stream
+            self.writer.write(connection.data_to_send())
+            try:
+                await future
+            finally:
+                self.streams.pop(stream_id, None)
+                if (future.cancelled() or not future.done()) and self.connection is connection:
+                    self._reset_stream(connection, stream_id)
+                self.stream_closed.set()
+            return stream.status, bytes(stream.body)
+
+    def _reset_stream(self, connection, stream_id):
+        """
+        Cancels a stream whose caller gave up (timeout or cancelled hedge).
+        Without RST_STREAM the server and h2 keep counting it as open, and once
+        SETTINGS_MAX_CONCURRENT_STREAMS abandoned streams pile up no new request
+        can be sent on the connection.
+        """
+        try:
+            connection.reset_stream(stream_id, h2.errors.ErrorCodes.CANCEL)
+            self.writer.write(connection.data_to_send())
+        except h2.exceptions.ProtocolError:
+            pass  # The stream closed in the meantime
+
+    async def _read_loop(self, reader, connection):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    raise HTTP2Error("Connection closed by peer")
+                events = connection.receive_data(data)
+                for event in events:
+                    self._handle_event(connection, event)
+                outgoing = connection.data_to_send()
+                if outgoing:
+                    self.writer.write(outgoing)
+        except asyncio.CancelledError:
+            raise
+        except (OSError, HTTP2Error, h2.exceptions.ProtocolError) as e:
+            if self.connection is connection:
+                self._fail_all(e if isinstance(e, HTTP2Error) else HTTP2Error(str(e)))
+
+    def _handle_event(self, connection, event):
+        if isinstance(event, h2.events.ResponseReceived):
+            stream = self.streams.get(event.stream_id)
+            if stream is not None:
+                for name, value in event.headers:
+                    if name == b":status":
+                        stream.status = int(value)
+                        break
+        elif isinstance(event, h2.events.DataReceived):
+            stream = self.streams.get(event.stream_id)
+            if stream is not None:
+                stream.body += event.data
+            connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, h2.events.StreamEnded):
+            stream = self.streams.get(event.stream_id)
+            if stream is not None and not stream.future.done():
+                stream.future.set_result(None)
+        elif isinstance(event, h2.events.StreamReset):
+            stream = self.streams.get(event.stream_id)
+            if stream is not None and not stream.future.done():
+                stream.future.set_exception(HTTP2Error(f"Stream reset with code {event.error_code}"))
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            raise HTTP2Error(f"Connection terminated with code {event.error_code}")
@@ -0,0 +1,148 @@
+"""
+Failure handling for resolver backends.
+- CircuitBreakerBackend stops sending queries to an upstream after
+  repeated failures, failing fast until a cool-down has passed, then
+  lets a single probe through to decide whether to close again.
+- RetryingBackend retries retryable failures with exponential backoff
+  and full jitter, so transient errors do not become empty answers and
+  retries from many workers do not arrive in lockstep.
+"""
+
+import asyncio
+import random
+import time
+from c_dns_multiplexer.dns_wire import RCODE_SERVFAIL
+from c_dns_multiplexer.resolver_backends import DNSQueryError, DNSResolverBackend
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        :param failure_threshold: Consecutive failures that open the circuit.
+        :param reset_timeout: Seconds the circuit stays open before a probe is allowed.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+
+    def allow(self):
+        """Whether a query may be sent now. In half-open state only one probe is let through."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    @property
+    def available(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not self.probing
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.trips += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class CircuitBreakerBackend(DNSResolverBackend):
+    """Resolver backend failing fast while its upstream's circuit is open."""
+
+    def __init__(self, backend, breaker):
+        self.backend = backend
+        self.breaker = breaker
+        self.name = backend.name
+
+    @property
+    def available(self):
+        return self.breaker.available
+
+    async def start(self):
+        await self.backend.start()
+
+    async def close(self):
+        await self.backend.close()
+
+    async def query(self, name, record_type):
+        if not self.breaker.allow():
+            raise DNSQueryError(f"Circuit open for {self.name}")
+        try:
+            response = await self.backend.query(name, record_type)
+        except asyncio.CancelledError:
+            # A cancelled probe (e.g. the losing side of a hedge) says nothing about the upstream
+            self.breaker.probing = False
+            raise
+        except DNSQueryError as e:
+            if e.retryable:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return response
+
+
+class RetryingBackend(DNSResolverBackend):
+    """Resolver backend retrying retryable failures and SERVFAIL answers with jittered backoff."""
+
+    def __init__(self, backend, attempts=3, base_delay=0.1, max_delay=2.0):
+        """
+        :param backend: Wrapped backend.
+        :param attempts: Total attempts per query, including the first one.
+        :param base_delay: Backoff before the first retry, in seconds (doubled on every retry).
+        :param max_delay: Upper bound of the backoff, in seconds.
+        """
+        self.backend = backend
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    async def start(self):
+        await self.backend.start()
+
+    async def close(self):
+        await self.backend.close()
+
+    def backoff(self, attempt):
+        """Full jitter: a random delay up to the exponential backoff of the attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def query(self, name, record_type):
+        for attempt in range(self.attempts):
+            last_attempt = attempt == self.attempts - 1
+            try:
+                response = await self.backend.query(name, record_type)
+            except DNSQueryError as e:
+                if not e.retryable or last_attempt:
+                    raise
+            else:
+                if response.get('Status') != RCODE_SERVFAIL or last_attempt:
+                    return response
+            self.retries += 1
+            await asyncio.sleep(self.backoff(attempt))
@@ -0,0 +1,380 @@
+"""
+Pluggable resolver backends for CDNSMultiplexer.
+Every backend answers query(name, record_type) with a dict in the
+application/dns-json layout, so the multiplexer does not care whether
+the answer came over DoH or from a plain DNS server:
+
+- DoHJSONBackend: Cloudflare-style DNS-over-HTTPS JSON API (default).
+- DoHWireBackend: RFC 8484 DNS-over-HTTPS with binary
+  application/dns-message bodies, multiplexed over a few HTTP/2
+  connections (requires h2).
+- UDPResolverBackend: raw wire-format DNS over UDP, retrying over TCP
+  when the answer is truncated. Meant for a local caching resolver
+  such as unbound.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import ssl
+import struct
+from urllib.parse import urlsplit
+import aiohttp
+from dotenv import load_dotenv
+from c_dns_multiplexer.dns_wire import DNSWireError, decode_response, encode_query, new_query_id, query_id_of
+from c_dns_multiplexer.http2_client import HTTP2Connection, HTTP2Error
+
+try:
+    # orjson parses DoH JSON bodies several times faster than the json module
+    from orjson import loads as json_loads
+except ImportError:
+    def json_loads(body):
+        # Decoding first skips the encoding detection json.loads runs on bytes
+        return json.loads(body.decode('utf-8'))
+
+# Load environment variables from the .env file at the root of the app
+load_dotenv()
+
+DEFAULT_DOH_URL = "https://cloudflare-dns.com/dns-query"
+
+_shared_ssl_contexts = {}
+
+
+def shared_ssl_context(alpn_protocols=()):
+    """
+    SSL context shared by every DoH connection negotiating the same ALPN
+    protocols, so the CA bundle is loaded once per process instead of once
+    per session or connection.
+    :param alpn_protocols: Tuple of ALPN protocols, e.g. ('h2',). Empty for HTTP/1.1.
+    """
+    context = _shared_ssl_contexts.get(alpn_protocols)
+    if context is None:
+        context = ssl.create_default_context()
+        if alpn_protocols:
+            context.set_alpn_protocols(list(alpn_protocols))
+        _shared_ssl_contexts[alpn_protocols] = context
+    return context
+
+
+class ConnectorProfile:
+    """Connection pool settings for the aiohttp connector of the DoH JSON backend."""
+
+    def __init__(self, limit=0, limit_per_host=1000, keepalive_timeout=60.0, ttl_dns_cache=300):
+        """
+        :param limit: Maximum open connections in total (0 for no limit).
+        :param limit_per_host: Maximum open connections per upstream (0 for no limit). The default
+                               aiohttp limit of 100 would cap concurrency below the number of DNS workers.
+        :param keepalive_timeout: Seconds an idle connection is kept for reuse.
+        :param ttl_dns_cache: Seconds the upstream's own address is cached (None caches forever).
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            limit=int(os.getenv("DOH_POOL_LIMIT", "0")),
+            limit_per_host=int(os.getenv("DOH_POOL_LIMIT_PER_HOST", "1000")),
+            keepalive_timeout=float(os.getenv("DOH_KEEPALIVE_TIMEOUT", "60")),
+            ttl_dns_cache=int(os.getenv("DOH_TTL_DNS_CACHE", "300")),
+        )
+
+    def create_connector(self):
+        return aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=self.ttl_dns_cache,
+            ssl=shared_ssl_context(),
+        )
+
+
+class DNSQueryError(Exception):
+    """Raised by a backend when a query gets no usable answer."""
+
+    def __init__(self, message, retryable=True):
+        """
+        :param message: Description of the failure.
+        :param retryable: False when asking again cannot help (e.g. HTTP 400, malformed answer).
+        """
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def _is_retryable_status(status):
+    # Rate limiting and server-side errors are transient, other statuses are not
+    return status == 429 or status >= 500
+
+
+class DNSResolverBackend:
+    """Interface implemented by every resolver backend."""
+
+    name = "dns"  # Upstream label used in stats
+
+    @property
+    def available(self):
+        """Whether the backend currently accepts queries (False while a circuit breaker is open)."""
+        return True
+
+    async def start(self):
+        """Opens connections or sockets. Called once before the first query."""
+
+    async def close(self):
+        """Releases connections or sockets."""
+
+    async def query(self, name, record_type):
+        """
+        Resolves a single question.
+        :param name: Domain to query.
+        :param record_type: Record type name ('A', 'NS', ...).
+        :return: Response dict in the application/dns-json layout.
+        :raises DNSQueryError: If no usable answer was received.
+        """
+        raise NotImplementedError
+
+
+class DoHJSONBackend(DNSResolverBackend):
+    def __init__(self, url=DEFAULT_DOH_URL, connect_timeout=2.0, read_timeout=3.0, connector_profile=None):
+        """
+        :param url: DoH JSON endpoint.
+        :param connect_timeout: Seconds to wait for a connection.
+        :param read_timeout: Seconds to wait for the answer once connected.
+        :param connector_profile: ConnectorProfile for the connection pool (defaults if omitted).
+        """
+        self.url = url
+        self.name = urlsplit(url).hostname or url
+        self.headers = {"accept": "application/dns-json"}
+        self.timeout = aiohttp.ClientTimeout(
+            total=connect_timeout + read_timeout, sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self.connector_profile = connector_profile or ConnectorProfile()
+        self.session = None  # Will hold a reusable session for all requests
+
+    async def start(self):
+        """Initialize the aiohttp session for DNS queries."""
+        self.session = aiohttp.ClientSession(
+            connector=self.connector_profile.create_connector(), timeout=self.timeout
+        )
+
+    async def close(self):
+        """Close the aiohttp session."""
+        if self.session:
+            await self.session.close()
+
+    async def query(self, name, record_type):
+        url = f"{self.url}?name={name}&type={record_type}"
+        try:
+            async with self.session.get(url, headers=self.headers) as response:
+                if response.status != 200:
+                    raise DNSQueryError(f"HTTP {response.status} from {self.url}", _is_retryable_status(response.status))
+                body = await response.read()
+        except asyncio.TimeoutError:
+            raise DNSQueryError(f"DoH query for {name} {record_type} timed out")
+        except aiohttp.ClientError as e:
+            raise DNSQueryError(f"DoH query to {self.url} failed: {e}") from e
+        try:
+            return json_loads(body)
+        except ValueError as e:
+            raise DNSQueryError(f"Invalid JSON from {self.url}: {e}", retryable=False) from e
+
+
+class DoHWireBackend(DNSResolverBackend):
+    def __init__(self, url=DEFAULT_DOH_URL, connections=2, max_streams=100, timeout=3.0, ssl_context=None,
+                 connect_timeout=2.0):
+        """
+        :param url: RFC 8484 endpoint (http:// URLs use HTTP/2 with prior knowledge).
+        :param connections: Number of HTTP/2 connections; every query is a stream on one of them.
+        :param max_streams: Maximum concurrent streams per connection.
+        :param timeout: Seconds to wait for the answer of each query.
+        :param ssl_context: Optional SSL context for https:// URLs.
+        :param connect_timeout: Seconds to wait when (re)opening a connection.
+        """
+        self.url = url
+        self.name = urlsplit(url).hostname or url
+        self.timeout = timeout
+        self.headers = [(b"accept", b"application/dns-message"), (b"content-type", b"application/dns-message")]
+        ssl_context = ssl_context or shared_ssl_context(("h2",))
+        self.connections = [
+            HTTP2Connection(url, max_streams, ssl_context, connect_timeout=connect_timeout) for _ in range(connections)
+        ]
+        self._next_connection = itertools.cycle(self.connections)
+
+    async def start(self):
+        for connection in self.connections:
+            try:
+                await connection.connect()
+            except (OSError, HTTP2Error) as e:
+                # request() reconnects on its own, an unreachable upstream must not stop
+                # the pipeline from starting (its breaker takes it out of rotation)
+                print(f"Could not connect to {self.url}, will retry on the next query: {e}")
+
+    async def close(self):
+        for connection in self.connections:
+            await connection.close()
+
+    async def query(self, name, record_type):
+        # RFC 8484 recommends message id 0 so identical queries are cacheable
+        message = encode_query(name, record_type, query_id=0)
+        connection = next(self._next_connection)
+        try:
+            status, body = await asyncio.wait_for(
+                connection.request(b"POST", self.headers, message), self.timeout
+            )
+        except asyncio.TimeoutError:
+            raise DNSQueryError(f"DoH query for {name} {record_type} timed out")
+        except (OSError, HTTP2Error) as e:
+            raise DNSQueryError(f"DoH query to {self.url} failed: {e}") from e
+        if status != 200:
+            raise DNSQueryError(f"HTTP {status} from {self.url}", _is_retryable_status(status))
+        try:
+            return decode_response(body)
+        except DNSWireError as e:
+            raise DNSQueryError(str(e), retryable=False) from e
+
+
+class _UDPClientProtocol(asyncio.DatagramProtocol):
+    """Routes datagrams to the pending query with the same message id."""
+
+    def __init__(self, pending):
+        self.pending = pending
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            future = self.pending.get(query_id_of(data))
+        except DNSWireError:
+            return
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(DNSQueryError(f"UDP error: {exc}"))
+
+    def connection_lost(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(DNSQueryError("UDP socket closed"))
+
+
+class UDPResolverBackend(DNSResolverBackend):
+    def __init__(self, host="127.0.0.1", port=53, timeout=2.0):
+        """
+        :param host: Address of the DNS server.
+        :param port: Port of the DNS server.
+        :param timeout: Seconds to wait for each UDP or TCP answer.
+        """
+        self.host = host
+        self.port = port
+        self.name = f"{host}:{port}"
+        self.timeout = timeout
+        self.pending = {}  # message id -> future, shared by all queries on the socket
+        self.transport = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.transport, _protocol = await loop.create_datagram_endpoint(
+            lambda: _UDPClientProtocol(self.pending),
+            remote_addr=(self.host, self.port),
+        )
+
+    async def close(self):
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def _new_query_id(self):
+        query_id = new_query_id()
+        while query_id in self.pending:
+            query_id = new_query_id()
+        return query_id
+
+    async def query(self, name, record_type):
+        query_id = self._new_query_id()
+        message = encode_query(name, record_type, query_id)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[query_id] = future
+        try:
+            self.transport.sendto(message)
+            raw_response = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise DNSQueryError(f"UDP query for {name} {record_type} timed out")
+        finally:
+            self.pending.pop(query_id, None)
+
+        try:
+            response = decode_response(raw_response)
+        except DNSWireError as e:
+            raise DNSQueryError(str(e), retryable=False) from e
+
+        # The answer did not fit in a datagram, ask again over TCP
+        if response['TC']:
+            response = await self._query_tcp(message)
+        return response
+
+    async def _query_tcp(self, message):
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise DNSQueryError(f"TCP connection to {self.host}:{self.port} failed: {e}") from e
+        try:
+            writer.write(struct.pack('!H', len(message)) + message)
+            await writer.drain()
+            length = struct.unpack('!H', await asyncio.wait_for(reader.readexactly(2), self.timeout))[0]
+            return decode_response(await asyncio.wait_for(reader.readexactly(length), self.timeout))
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, DNSWireError) as e:
+            raise DNSQueryError(f"TCP query to {self.host}:{self.port} failed: {e}") from e
+        finally:
+            writer.close()
+
+
+def _split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def create_backends_from_env():
+    """
+    Builds one backend per upstream for the DNS_BACKEND type ('doh-json', 'doh-wire' or 'udp').
+    Upstreams come from DOH_URLS (or DOH_URL) for DoH, and DNS_UDP_SERVERS (or DNS_UDP_SERVER) for UDP,
+    as comma-separated lists.
+    """
+    backend = os.getenv("DNS_BACKEND", "doh-json")
+    connect_timeout = float(os.getenv("DNS_CONNECT_TIMEOUT", "2.0"))
+    read_timeout = float(os.getenv("DNS_READ_TIMEOUT", "3.0"))
+    if backend == "udp":
+        backends = []
+        for server in _split_list(os.getenv("DNS_UDP_SERVERS") or os.getenv("DNS_UDP_SERVER", "127.0.0.1:53")):
+            host, _, port = server.rpartition(':')
+            backends.append(UDPResolverBackend(
+                host=host.strip("[]") or "127.0.0.1",
+                port=int(port),
+                timeout=float(os.getenv("DNS_UDP_TIMEOUT", "2.0")),
+            ))
+        return backends
+
+    urls = _split_list(os.getenv("DOH_URLS") or os.getenv("DOH_URL", DEFAULT_DOH_URL))
+    if backend == "doh-json":
+        connector_profile = ConnectorProfile.from_env()
+        return [DoHJSONBackend(url, connect_timeout, read_timeout, connector_profile) for url in urls]
+    if backend == "doh-wire":
+        return [
+            DoHWireBackend(
+                url,
+                connections=int(os.getenv("DOH_HTTP2_CONNECTIONS", "2")),
+                max_streams=int(os.getenv("DOH_HTTP2_MAX_STREAMS", "100")),
+                timeout=read_timeout,
+                connect_timeout=connect_timeout,
+            )
+            for url in urls
+        ]
+    raise ValueError(f"Unknown DNS_BACKEND: {backend}")
@@ -0,0 +1,149 @@
+"""
+Pool of resolver upstreams with latency-weighted load balancing.
+Each upstream tracks an EWMA of its latency and error rate, and queries
+are spread across upstreams in proportion to how fast and healthy they
+are. When a query is slower than the recent p95 latency, a hedged copy
+is sent to a second upstream and whichever answers first wins, so one
+slow upstream no longer sets the tail latency of the whole pipeline.
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from c_dns_multiplexer.resolver_backends import DNSResolverBackend
+
+
+def _retrieve_exception(task):
+    # The losing side of a hedged query may fail after the winner returned
+    if not task.cancelled():
+        task.exception()
+
+
+class Upstream:
+    __slots__ = ("backend", "name", "ewma_latency", "error_rate", "queries", "errors")
+
+    def __init__(self, backend, name, initial_latency=0.05):
+        self.backend = backend
+        self.name = name
+        self.ewma_latency = initial_latency  # Seconds
+        self.error_rate = 0.0
+        self.queries = 0
+        self.errors = 0
+
+    @property
+    def weight(self):
+        # Faster upstreams get more traffic, failing ones get almost none,
+        # but never zero so they are probed and can recover
+        return max(1.0 - self.error_rate, 0.01) / max(self.ewma_latency, 0.001)
+
+
+class UpstreamPool(DNSResolverBackend):
+    def __init__(self, backends, alpha=0.2, hedge=True, hedge_quantile=0.95,
+                 min_hedge_delay=0.01, max_hedge_delay=1.0, latency_window=500):
+        """
+        :param backends: Resolver backends, one per upstream.
+        :param alpha: EWMA smoothing factor for latency and error rate.
+        :param hedge: Send a hedged duplicate to a second upstream for slow queries.
+        :param hedge_quantile: Latency quantile after which a query is hedged.
+        :param min_hedge_delay: Lower bound of the hedge delay, in seconds.
+        :param max_hedge_delay: Upper bound of the hedge delay, in seconds.
+        :param latency_window: Number of recent latencies used for the quantile.
+        """
+        self.upstreams = [Upstream(backend, backend.name) for backend in backends]
+        self.alpha = alpha
+        self.hedge = hedge and len(self.upstreams) > 1
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.latencies = deque(maxlen=latency_window)
+        self.latency_samples = 0  # Total samples, the window length stops growing once full
+        self.hedge_delay = max_hedge_delay
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    async def start(self):
+        for upstream in self.upstreams:
+            await upstream.backend.start()
+
+    async def close(self):
+        for upstream in self.upstreams:
+            await upstream.backend.close()
+
+    def _pick(self, exclude=None):
+        # Skip upstreams whose circuit breaker is open, unless none is left
+        candidates = [upstream for upstream in self.upstreams if upstream is not exclude and upstream.backend.available]
+        if not candidates:
+            candidates = [upstream for upstream in self.upstreams if upstream is not exclude]
+        return random.choices(candidates, weights=[upstream.weight for upstream in candidates])[0]
+
+    def _record(self, upstream, latency=None):
+        upstream.queries += 1
+        alpha = self.alpha
+        if latency is None:
+            # A failure counts as a very slow answer, so the upstream quickly loses weight
+            upstream.errors += 1
+            upstream.error_rate += alpha * (1.0 - upstream.error_rate)
+            upstream.ewma_latency += alpha * (self.max_hedge_delay - upstream.ewma_latency)
+            return
+        upstream.error_rate -= alpha * upstream.error_rate
+        upstream.ewma_latency += alpha * (latency - upstream.ewma_latency)
+        self.latencies.append(latency)
+        self.latency_samples += 1
+        # Refresh the hedge delay every 50 samples instead of sorting on every query
+        if self.latency_samples % 50 == 0:
+            ordered = sorted(self.latencies)
+            quantile = ordered[min(int(len(ordered) * self.hedge_quantile), len(ordered) - 1)]
+            self.hedge_delay = min(max(quantile, self.min_hedge_delay), self.max_hedge_delay)
+
+    async def _query_upstream(self, upstream, name, record_type):
+        started_at = time.monotonic()
+        try:
+            response = await upstream.backend.query(name, record_type)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._record(upstream)
+            raise
+        self._record(upstream, time.monotonic() - started_at)
+        return response
+
+    async def query(self, name, record_type):
+        primary = self._pick()
+        if not self.hedge:
+            return await self._query_upstream(primary, name, record_type)
+
+        primary_task = asyncio.create_task(self._query_upstream(primary, name, record_type))
+        primary_task.add_done_callback(_retrieve_exception)
+        pending = {primary_task}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay)
+            if done:
+                return primary_task.result()
+
+            # The primary is slower than the recent p95, race it against a second upstream
+            self.hedged += 1
+            hedge_task = asyncio.create_task(self._query_upstream(self._pick(exclude=primary), name, record_type))
+            hedge_task.add_done_callback(_retrieve_exception)
+            pending = {primary_task, hedge_task}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        stats = {"hedge_delay_ms": round(self.hedge_delay * 1000, 1), "hedged": self.hedged, "hedge_wins": self.hedge_wins}
+        for upstream in self.upstreams:
+            stats[f"{upstream.name}_latency_ms"] = round(upstream.ewma_latency * 1000, 1)
+            stats[f"{upstream.name}_error_rate"] = round(upstream.error_rate, 4)
+            stats[f"{upstream.name}_queries"] = upstream.queries
+        return stats
@@ -0,0 +1,51 @@
+"""
+Nameserver cache keyed by registered domain (zone).
+For a subdomain such as login.example.com, the NS query is answered
+from the parent zone's Authority section (SOA), which is the same for
+every sibling subdomain. Once one sibling has been resolved, the rest
+reuse its nameservers and only send the A query.
+This is an approximation: whether a subdomain is delegated can only be
+seen from its own NS answer, which is no longer queried once the zone is
+cached. A delegated subdomain arriving after a non-delegated sibling gets
+the zone's nameservers instead of its own. Apex domains, and subdomains
+of zones not cached yet, still send the NS query.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class ZoneNameserverCache:
+    def __init__(self, max_size=100000, ttl=3600):
+        """
+        :param max_size: Maximum number of zones kept, least recently used evicted first.
+        :param ttl: Seconds a zone's nameservers are reused.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # zone -> (expiry time, nameservers)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, zone):
+        """
+        :return: Cached nameservers of the zone, or None.
+        """
+        entry = self.entries.get(zone)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self.entries[zone]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(zone)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, zone, nameservers):
+        self.entries[zone] = (time.monotonic() + self.ttl, tuple(nameservers))
+        self.entries.move_to_end(zone)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
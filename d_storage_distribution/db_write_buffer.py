@@ -0,0 +1,111 @@
+"""
+Write-behind buffer for the IP and nameserver rows of enriched domains.
+Rows of many domains are collected in memory and written in one
+transaction once DB_WRITE_FLUSH_ROWS rows are pending or every
+DB_WRITE_FLUSH_INTERVAL_MS, instead of two commits per domain. The
+buffer is bounded: once DB_WRITE_MAX_ROWS rows are pending, add() waits
+for the database to catch up. add() returns a future resolved when the
+flush holding the rows completes, so callers can act after the commit.
+"""
+
+import asyncio
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file at the root of the app
+load_dotenv()
+
+
+class DBWriteBuffer:
+    def __init__(self, db_manager, flush_rows=None, flush_interval=None, max_rows=None):
+        """
+        :param db_manager: Database manager from create_db_manager(), its insert_enrichment is awaited.
+        :param flush_rows: Pending rows that trigger a flush.
+        :param flush_interval: Seconds between periodic flushes.
+        :param max_rows: Pending rows at which add() waits for a flush to complete.
+        """
+        self.db_manager = db_manager
+        self.flush_rows = flush_rows or int(os.getenv("DB_WRITE_FLUSH_ROWS", "2000"))
+        self.flush_interval = flush_interval or int(os.getenv("DB_WRITE_FLUSH_INTERVAL_MS", "500")) / 1000
+        self.max_rows = max_rows or int(os.getenv("DB_WRITE_MAX_ROWS", "20000"))
+        self.ip_rows = []
+        self.ns_rows = []
+        self.commit_future = None  # Resolved by the flush that writes the pending rows
+
+        # One flush at a time, so rows are committed in the order they were added
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+        self.interval_task = None
+
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self.ip_rows) + len(self.ns_rows)
+
+    async def start(self):
+        """Starts the periodic flush."""
+        self.interval_task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """Stops the periodic flush and writes whatever is still pending."""
+        if self.interval_task:
+            self.interval_task.cancel()
+            await asyncio.gather(self.interval_task, return_exceptions=True)
+            self.interval_task = None
+        await self.flush()
+
+    async def add(self, ip_rows, ns_rows):
+        """
+        Buffers the rows of one or more domains.
+        :param ip_rows: List of tuples containing (domain_id, ip).
+        :param ns_rows: List of tuples containing (domain_id, ns).
+        :return: Future resolved with True once the rows are committed, or False if the commit failed.
+        """
+        loop = asyncio.get_running_loop()
+        if not ip_rows and not ns_rows:
+            # Nothing to write, the caller does not need to wait for a flush
+            commit_future = loop.create_future()
+            commit_future.set_result(True)
+            return commit_future
+        if self.commit_future is None:
+            self.commit_future = loop.create_future()
+        commit_future = self.commit_future
+
+        self.ip_rows.extend(ip_rows)
+        self.ns_rows.extend(ns_rows)
+        pending = len(self)
+        if pending >= self.max_rows:
+            # The database is falling behind, wait instead of growing the buffer
+            await self.flush()
+        elif pending >= self.flush_rows and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = asyncio.create_task(self.flush())
+        return commit_future
+
+    async def flush(self):
+        """Writes all pending rows in one transaction."""
+        async with self.flush_lock:
+            if not len(self):
+                return
+            ip_rows, self.ip_rows = self.ip_rows, []
+            ns_rows, self.ns_rows = self.ns_rows, []
+            commit_future, self.commit_future = self.commit_future, None
+            committed = False
+            try:
+                committed = await self.db_manager.insert_enrichment(ip_rows, ns_rows)
+            finally:
+                commit_future.set_result(committed)
+            self.flushes += 1
+            if committed:
+                self.rows_written += len(ip_rows) + len(ns_rows)
+            else:
+                self.rows_failed += len(ip_rows) + len(ns_rows)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing database writes: {e}")
@@ -0,0 +1,338 @@
+"""
+Awaitable database managers used by the pipeline stages.
+Both classes expose the same coroutine interface, so process_b and
+process_d await their queries instead of blocking the event loop:
+- AsyncDBManager talks to MySQL natively through an aiomysql pool.
+- ThreadedDBManager runs the pymysql DBManager on a thread pool sized
+  to its connection pool.
+DB_DRIVER selects which one create_db_manager() returns.
+"""
+
+import asyncio
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pymysql
+from dotenv import load_dotenv
+from db_manager.db_manager import DBManager
+
+try:
+    import aiomysql
+except ImportError:  # Only needed when DB_DRIVER=aiomysql
+    aiomysql = None
+
+# Load environment variables from the .env file at the root of the app
+load_dotenv()
+
+DB_DRIVERS = ("pymysql", "aiomysql")
+
+
+class AsyncDBManager:
+    def __init__(self):
+        # Load DB credentials from environment variables
+        self.host = os.getenv("DB_HOST")
+        self.port = int(os.getenv("DB_PORT"))
+        self.user = os.getenv("DB_USER")
+        self.password = os.getenv("DB_PASSWORD")
+        self.db = os.getenv("DB_NAME")
+
+        # Load dynamic table names from environment variables
+        self.table_domains = os.getenv("DB_TABLE_DOMAINS")
+        self.table_ips = os.getenv("DB_TABLE_IPS")
+        self.table_ns = os.getenv("DB_TABLE_NS")
+
+        # Connection pool settings
+        self.pool_size = int(os.getenv("DB_POOL_SIZE", "4"))
+        self.pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+
+        self.pool = None
+        self.pool_lock = None  # Created on first use, inside the running loop
+
+    async def init_connection(self):
+        """
+        Initialize the aiomysql connection pool.
+        Safe to call more than once: every stage sharing this manager reuses the same pool.
+        """
+        if aiomysql is None:
+            raise RuntimeError("DB_DRIVER=aiomysql requires the aiomysql package: pip install aiomysql")
+        if self.pool_lock is None:
+            self.pool_lock = asyncio.Lock()
+        async with self.pool_lock:
+            if self.pool is None:
+                await self._create_pool()
+
+    async def _create_pool(self):
+        try:
+            # Autocommit keeps read-only checkouts out of transactions; writes call begin()
+            self.pool = await aiomysql.create_pool(
+                host=self.host,
+                port=self.port,
+                user=self.user,
+                password=self.password,
+                db=self.db,
+                charset='utf8mb4',
+                cursorclass=aiomysql.DictCursor,
+                autocommit=True,
+                minsize=1,
+                maxsize=self.pool_size,
+                pool_recycle=self.pool_recycle
+            )
+            print(f"Database connection pool initialized (size {self.pool_size}).")
+        except (pymysql.MySQLError, OSError) as e:
+            print(f"Error connecting to the database: {e}")
+
+    async def close_connection(self):
+        """Close every pooled database connection."""
+        if self.pool:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+            print("Database connection closed.")
+
+    def stats(self):
+        """
+        :return: Dictionary with the pool counters.
+        """
+        if self.pool is None:
+            return {}
+        return {
+            'pool_size': self.pool.size,
+            'pool_max_size': self.pool.maxsize,
+            'pool_free': self.pool.freesize,
+        }
+
+    async def _get_pool(self):
+        """
+        Returns the pool, trying to create it again if init_connection failed.
+        :raises pymysql.OperationalError: If the database is still unreachable,
+            so callers handle it like any other database error.
+        """
+        if self.pool is None:
+            await self.init_connection()
+            if self.pool is None:
+                raise pymysql.OperationalError(2003, "No database connection pool")
+        return self.pool
+
+    # A connection released in the middle of a transaction (a statement failed
+    # before commit) is closed by the aiomysql pool instead of being reused.
+
+    async def find_duplicates(self, domains, chunk_size=1000):
+        """
+        Check which domains already exist in the database.
+        Domains are checked in batches with a single IN query per chunk.
+        :param domains: List of domains to check.
+        :param chunk_size: Maximum number of domains per query.
+        :return: List of booleans where True means the domain exists (is a duplicate).
+        """
+        existing = set()
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as connection, connection.cursor() as cursor:
+                for start in range(0, len(domains), chunk_size):
+                    chunk = domains[start:start + chunk_size]
+                    placeholders = ', '.join(['%s'] * len(chunk))
+                    sql_query = f"SELECT domain FROM {self.table_domains} WHERE domain IN ({placeholders})"
+                    await cursor.execute(sql_query, chunk)
+                    existing.update(row['domain'].lower() for row in await cursor.fetchall())
+        except pymysql.MySQLError as e:
+            print(f"Database error: {e}")
+            return [False] * len(domains)  # Assume non-duplicate on error
+        return [domain.lower() in existing for domain in domains]
+
+    async def iter_domains(self, batch_size=10000):
+        """
+        Stream every domain stored in the domains table.
+        Uses an unbuffered cursor so the table is never fully loaded in memory.
+        :param batch_size: Number of rows fetched per round trip.
+        :raises pymysql.MySQLError: If the table could not be read to the end.
+        :return: Async generator of domains.
+        """
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as connection, connection.cursor(aiomysql.SSCursor) as cursor:
+                await cursor.execute(f"SELECT domain FROM {self.table_domains}")
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row[0]
+        except pymysql.MySQLError as e:
+            print(f"Database error: {e}")
+            raise  # The caller must know the scan is incomplete
+
+    async def insert_non_duplicates(self, domains, chunk_size=1000):
+        """
+        Insert only non-duplicate domains into the database, ignoring duplicates.
+        Same statements as DBManager.insert_non_duplicates, in one transaction.
+        :param domains: List of domains to check and insert if non-duplicate.
+        :param chunk_size: Maximum number of rows per INSERT statement.
+        :return: Dictionary {domain: id} of successfully inserted domains, or None if the transaction failed.
+        """
+        inserted_domains_ids = {}
+        domains = list(dict.fromkeys(domains))  # Deduplicate, keeping order
+
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as connection, connection.cursor() as cursor:
+                await connection.begin()
+                for start in range(0, len(domains), chunk_size):
+                    chunk = domains[start:start + chunk_size]
+                    await cursor.execute("SAVEPOINT insert_chunk")
+                    values = ', '.join(['(%s)'] * len(chunk))
+                    sql_query = f"INSERT IGNORE INTO {self.table_domains} (domain) VALUES {values}"
+                    await cursor.execute(sql_query, chunk)
+                    inserted_rows = cursor.rowcount
+
+                    # Nothing was inserted, every domain in the chunk is a duplicate
+                    if inserted_rows <= 0 or not cursor.lastrowid:
+                        continue
+
+                    first_id = cursor.lastrowid
+                    placeholders = ', '.join(['%s'] * len(chunk))
+                    sql_query = f"SELECT id, domain FROM {self.table_domains} WHERE domain IN ({placeholders}) AND id >= %s"
+                    await cursor.execute(sql_query, chunk + [first_id])
+                    rows = await cursor.fetchall()
+
+                    if len(rows) > inserted_rows:
+                        # Another connection committed some of these domains while the INSERT ran,
+                        # so their ids are above first_id too. Redo the chunk one row at a time,
+                        # where rowcount and lastrowid tell exactly which rows are ours.
+                        await cursor.execute("ROLLBACK TO SAVEPOINT insert_chunk")
+                        rows = []
+                        sql_query = f"INSERT IGNORE INTO {self.table_domains} (domain) VALUES (%s)"
+                        for domain in chunk:
+                            await cursor.execute(sql_query, [domain])
+                            if cursor.rowcount > 0:
+                                rows.append({'id': cursor.lastrowid, 'domain': domain})
+
+                    for row in rows:
+                        inserted_domains_ids[row['domain']] = row['id']
+
+                await connection.commit()
+
+        except pymysql.MySQLError as e:
+            print(f"Database error: {e}")
+            return None
+
+        return inserted_domains_ids
+
+    async def insert_enrichment(self, ip_data, ns_data, chunk_size=1000):
+        """
+        Insert IP and nameserver rows of many domains in a single transaction.
+        :param ip_data: List of tuples containing (domain_id, ip).
+        :param ns_data: List of tuples containing (domain_id, ns).
+        :param chunk_size: Maximum number of rows per INSERT statement.
+        :return: True if the transaction was committed.
+        """
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as connection, connection.cursor() as cursor:
+                await connection.begin()
+                for table, column, rows in ((self.table_ips, 'ip', ip_data), (self.table_ns, 'ns', ns_data)):
+                    for start in range(0, len(rows), chunk_size):
+                        chunk = rows[start:start + chunk_size]
+                        values = ', '.join(['(%s, %s)'] * len(chunk))
+                        sql_query = f"INSERT INTO {table} (domain_id, {column}) VALUES {values}"
+                        await cursor.execute(sql_query, [value for row in chunk for value in row])
+                await connection.commit()
+            return True
+        except pymysql.MySQLError as e:
+            print(f"Database error: {e}")
+            return False
+
+    async def insert_domains_ns(self, data):
+        """
+        Insert nameserver (NS) data into the domains_ns table.
+        :param data: List of tuples containing (domain_id, ns).
+        """
+        await self._insert_pairs(self.table_ns, 'ns', data)
+
+    async def insert_domains_ip(self, data):
+        """
+        Insert IP data into the domains_ip table.
+        :param data: List of tuples containing (domain_id, ip).
+        """
+        await self._insert_pairs(self.table_ips, 'ip', data)
+
+    async def _insert_pairs(self, table, column, data):
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as connection, connection.cursor() as cursor:
+                await connection.begin()
+                sql_query = f"INSERT INTO {table} (domain_id, {column}) VALUES (%s, %s)"
+                await cursor.executemany(sql_query, data)
+                await connection.commit()
+        except pymysql.MySQLError as e:
+            print(f"Database error: {e}")
+
+
+class ThreadedDBManager:
+    def __init__(self, db_manager=None):
+        """
+        :param db_manager: pymysql DBManager to run off the event loop (a new one if omitted).
+        """
+        self.db_manager = db_manager or DBManager()
+        # One thread per pooled connection, so no query waits for a thread
+        self.db_executor = ThreadPoolExecutor(
+            max_workers=self.db_manager.pool_size, thread_name_prefix="db_manager"
+        )
+
+    def _run(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self.db_executor, function, *args)
+
+    async def init_connection(self):
+        await self._run(self.db_manager.init_connection)
+
+    async def close_connection(self):
+        await self._run(self.db_manager.close_connection)
+
+    def stats(self):
+        return self.db_manager.stats()
+
+    async def find_duplicates(self, domains, chunk_size=1000):
+        return await self._run(self.db_manager.find_duplicates, domains, chunk_size)
+
+    async def iter_domains(self, batch_size=10000):
+        # The generator keeps its connection checked out and is advanced one batch per executor call
+        domains = self.db_manager.iter_domains(batch_size)
+
+        def next_batch():
+            return list(itertools.islice(domains, batch_size))
+
+        try:
+            while True:
+                batch = await self._run(next_batch)
+                if not batch:
+                    break
+                for domain in batch:
+                    yield domain
+        finally:
+            # Returns the connection if the caller stopped early
+            await self._run(domains.close)
+
+    async def insert_non_duplicates(self, domains, chunk_size=1000):
+        return await self._run(self.db_manager.insert_non_duplicates, domains, chunk_size)
+
+    async def insert_enrichment(self, ip_data, ns_data, chunk_size=1000):
+        return await self._run(self.db_manager.insert_enrichment, ip_data, ns_data, chunk_size)
+
+    async def insert_domains_ns(self, data):
+        await self._run(self.db_manager.insert_domains_ns, data)
+
+    async def insert_domains_ip(self, data):
+        await self._run(self.db_manager.insert_domains_ip, data)
+
+
+def create_db_manager(driver=None):
+    """
+    Builds the database manager selected by DB_DRIVER.
+    :param driver: 'pymysql' (DBManager on threads, the default) or 'aiomysql' (native asyncio).
+    :return: AsyncDBManager or ThreadedDBManager, not connected yet.
+    """
+    driver = (driver or os.getenv("DB_DRIVER", "pymysql")).lower()
+    if driver not in DB_DRIVERS:
+        raise ValueError(f"Unknown DB_DRIVER {driver!r}, expected one of {', '.join(DB_DRIVERS)}")
+    if driver == "aiomysql":
+        return AsyncDBManager()
+    return ThreadedDBManager()
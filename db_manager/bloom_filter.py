@@ -0,0 +1,169 @@
+"""
+Scalable Bloom filter of domains already stored in the database.
+It answers "definitely new" or "probably seen" without a round trip
+to MySQL, and grows by adding larger, tighter slices once the current
+one is full, so the false positive rate stays bounded as the domains
+table grows. The filter can be saved to and loaded from disk.
+"""
+
+import hashlib
+import math
+import os
+import struct
+import tempfile
+
+_MAGIC = b'WDBF'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBddI')      # magic, version, growth, tightening, slice count
+_SLICE_HEADER = struct.Struct('<QdQIQ')  # capacity, error rate, bits, hashes, count
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, h1, h2):
+        num_bits = self.num_bits
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % num_bits
+
+    def contains_hashes(self, h1, h2):
+        bits = self.bits
+        for position in self._positions(h1, h2):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add_hashes(self, h1, h2):
+        bits = self.bits
+        for position in self._positions(h1, h2):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter:
+    def __init__(self, initial_capacity=1000000, error_rate=0.001, growth=2, tightening=0.9):
+        """
+        :param initial_capacity: Number of domains the first slice holds at error_rate.
+        :param error_rate: Target false positive rate of the first slice.
+        :param growth: Capacity multiplier for every new slice.
+        :param tightening: Error rate multiplier for every new slice.
+        """
+        self.growth = growth
+        self.tightening = tightening
+        self.slices = [BloomFilter(initial_capacity, error_rate)]
+        self.dirty = False  # True when there are additions not yet saved to disk
+
+    @staticmethod
+    def _hashes(domain):
+        digest = hashlib.blake2b(domain.lower().encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return h1, h2 | 1
+
+    def __contains__(self, domain):
+        h1, h2 = self._hashes(domain)
+        return any(bloom_slice.contains_hashes(h1, h2) for bloom_slice in self.slices)
+
+    def __len__(self):
+        return sum(bloom_slice.count for bloom_slice in self.slices)
+
+    def add(self, domain):
+        """
+        Adds a domain to the filter.
+        :return: True if the domain was not (probably) present before.
+        """
+        h1, h2 = self._hashes(domain)
+        if any(bloom_slice.contains_hashes(h1, h2) for bloom_slice in self.slices):
+            return False
+        current = self.slices[-1]
+        if current.is_full:
+            current = BloomFilter(current.capacity * self.growth, current.error_rate * self.tightening)
+            self.slices.append(current)
+        current.add_hashes(h1, h2)
+        self.dirty = True
+        return True
+
+    def update(self, domains):
+        for domain in domains:
+            self.add(domain)
+
+    def copy(self):
+        """
+        Returns an independent copy, so a snapshot can be saved from another
+        thread while this filter keeps changing.
+        """
+        bloom = ScalableBloomFilter.__new__(ScalableBloomFilter)
+        bloom.growth = self.growth
+        bloom.tightening = self.tightening
+        bloom.slices = []
+        bloom.dirty = self.dirty
+        for bloom_slice in self.slices:
+            slice_copy = BloomFilter.__new__(BloomFilter)
+            slice_copy.capacity = bloom_slice.capacity
+            slice_copy.error_rate = bloom_slice.error_rate
+            slice_copy.num_bits = bloom_slice.num_bits
+            slice_copy.num_hashes = bloom_slice.num_hashes
+            slice_copy.count = bloom_slice.count
+            slice_copy.bits = bytearray(bloom_slice.bits)
+            bloom.slices.append(slice_copy)
+        return bloom
+
+    def save(self, path):
+        """
+        Writes the filter to path atomically (temporary file + rename).
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.bloom-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, self.growth, self.tightening, len(self.slices)))
+                for bloom_slice in self.slices:
+                    f.write(_SLICE_HEADER.pack(
+                        bloom_slice.capacity, bloom_slice.error_rate, bloom_slice.num_bits,
+                        bloom_slice.num_hashes, bloom_slice.count
+                    ))
+                    f.write(bloom_slice.bits)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a filter previously written with save().
+        :raises ValueError: If the file is not a valid filter.
+        """
+        with open(path, 'rb') as f:
+            magic, version, growth, tightening, num_slices = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"{path} is not a bloom filter file")
+            bloom = cls.__new__(cls)
+            bloom.growth = growth
+            bloom.tightening = tightening
+            bloom.slices = []
+            bloom.dirty = False
+            for _ in range(num_slices):
+                capacity, error_rate, num_bits, num_hashes, count = _SLICE_HEADER.unpack(f.read(_SLICE_HEADER.size))
+                bloom_slice = BloomFilter.__new__(BloomFilter)
+                bloom_slice.capacity = capacity
+                bloom_slice.error_rate = error_rate
+                bloom_slice.num_bits = num_bits
+                bloom_slice.num_hashes = num_hashes
+                bloom_slice.count = count
+                bloom_slice.bits = bytearray(f.read((num_bits + 7) // 8))
+                if len(bloom_slice.bits) != (num_bits + 7) // 8:
+                    raise ValueError(f"{path} is truncated")
+                bloom.slices.append(bloom_slice)
+        return bloom
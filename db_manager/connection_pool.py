@@ -0,0 +1,121 @@
+"""
+Bounded, thread-safe pool of pymysql connections.
+Connections are checked out for one operation at a time by whichever
+thread runs the database work, so several stages and executor threads
+can talk to MySQL in parallel without sharing a connection. Idle
+connections are pinged (and transparently reconnected) before reuse,
+a connection that failed during an operation is thrown away, and one
+returned inside a transaction is rolled back first.
+"""
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import pymysql
+from pymysql.constants.SERVER_STATUS import SERVER_STATUS_IN_TRANS
+
+
+class PoolTimeoutError(pymysql.MySQLError):
+    """Raised when no connection became available in time."""
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_size=4, timeout=30.0, ping_interval=30.0):
+        """
+        :param connect: Function opening a new pymysql connection.
+        :param max_size: Maximum number of open connections.
+        :param timeout: Seconds to wait for a free connection before raising PoolTimeoutError.
+        :param ping_interval: Seconds a connection may sit idle before it is pinged on checkout.
+        """
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.idle = queue.LifoQueue()  # (connection, returned at) pairs, most recent first
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.size = 0
+        self.reconnects = 0
+        self.discarded = 0
+
+    def _checkout(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"No database connection available after {self.timeout}s")
+        try:
+            try:
+                connection, returned_at = self.idle.get_nowait()
+            except queue.Empty:
+                connection = self.connect()
+                with self.lock:
+                    self.size += 1
+                return connection
+
+            # Health check: the server may have closed an idle connection (wait_timeout)
+            if time.monotonic() - returned_at >= self.ping_interval:
+                thread_id = connection.thread_id()
+                try:
+                    connection.ping(reconnect=True)
+                except pymysql.MySQLError:
+                    self._discard(connection)
+                    raise
+                if connection.thread_id() != thread_id:
+                    self.reconnects += 1
+            return connection
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _discard(self, connection):
+        with self.lock:
+            self.size -= 1
+            self.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection for the duration of the with block.
+        On error, or if the block left a transaction open, the transaction is rolled
+        back; a connection that raised a connection-level error is closed instead.
+        """
+        connection = self._checkout()
+        try:
+            yield connection
+        except (pymysql.OperationalError, pymysql.InterfaceError):
+            self._discard(connection)
+            self.slots.release()
+            raise
+        except BaseException:
+            self._release(connection, rollback=True)
+            raise
+        else:
+            self._release(connection)
+
+    def _release(self, connection, rollback=False):
+        try:
+            # An open transaction would pin an old snapshot on an idle connection
+            if rollback or connection.server_status & SERVER_STATUS_IN_TRANS:
+                connection.rollback()
+            reusable = connection.open
+        except pymysql.MySQLError:
+            reusable = False
+        if reusable:
+            self.idle.put((connection, time.monotonic()))
+        else:
+            self._discard(connection)
+        self.slots.release()
+
+    def close(self):
+        """Closes every idle connection."""
+        while True:
+            try:
+                connection, _returned_at = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.size -= 1
+            connection.close()
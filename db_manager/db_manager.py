@@ -1,6 +1,7 @@
 import pymysql
 from dotenv import load_dotenv
 import os
+from db_manager.connection_pool import ConnectionPool
 
 # Load environment variables from the .env file at the root of the app
 load_dotenv()
@@ -18,90 +19,212 @@ class DBManager:
         self.table_domains = os.getenv("DB_TABLE_DOMAINS")
         self.table_ips = os.getenv("DB_TABLE_IPS")
         self.table_ns = os.getenv("DB_TABLE_NS")
-        
-        self.connection = None
+
+        # Connection pool settings
+        self.pool_size = int(os.getenv("DB_POOL_SIZE", "4"))
+        self.pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+        self.pool_ping_interval = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))
+
+        self.pool = None
+
+    def _connect(self):
+        return pymysql.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            db=self.db,
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor,
+            # Reads must not leave pooled connections inside a transaction (an old
+            # REPEATABLE READ snapshot); writes open one explicitly with begin()
+            autocommit=True
+        )
 
     def init_connection(self):
-        """Initialize the database connection."""
-        try:
-            self.connection = pymysql.connect(
-                host=self.host,
-                port=self.port,
-                user=self.user,
-                password=self.password,
-                db=self.db,
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor
+        """
+        Initialize the connection pool.
+        Safe to call more than once: every stage sharing this manager reuses the same pool.
+        One connection is opened right away to check the database is reachable.
+        """
+        if self.pool is None:
+            self.pool = ConnectionPool(
+                self._connect,
+                max_size=self.pool_size,
+                timeout=self.pool_timeout,
+                ping_interval=self.pool_ping_interval
             )
-            print("Database connection initialized.")
+        try:
+            with self.pool.connection():
+                pass
+            print(f"Database connection pool initialized (size {self.pool_size}).")
         except pymysql.MySQLError as e:
             print(f"Error connecting to the database: {e}")
-    
+
     def close_connection(self):
-        """Close the database connection."""
-        if self.connection:
-            self.connection.close()
+        """Close every pooled database connection."""
+        if self.pool:
+            self.pool.close()
             print("Database connection closed.")
 
-    def find_duplicates(self, domains):
+    def stats(self):
+        """
+        :return: Dictionary with the pool counters.
+        """
+        if self.pool is None:
+            return {}
+        return {
+            'pool_size': self.pool.size,
+            'pool_max_size': self.pool.max_size,
+            'pool_reconnects': self.pool.reconnects,
+            'pool_discarded': self.pool.discarded,
+        }
+
+    def find_duplicates(self, domains, chunk_size=1000):
         """
         Check which domains already exist in the database.
+        Domains are checked in batches with a single IN query per chunk.
         :param domains: List of domains to check.
+        :param chunk_size: Maximum number of domains per query.
         :return: List of booleans where True means the domain exists (is a duplicate).
         """
-        duplicate_flags = []
+        existing = set()
+        try:
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                for start in range(0, len(domains), chunk_size):
+                    chunk = domains[start:start + chunk_size]
+                    placeholders = ', '.join(['%s'] * len(chunk))
+                    sql_query = f"SELECT domain FROM {self.table_domains} WHERE domain IN ({placeholders})"
+                    cursor.execute(sql_query, chunk)
+                    existing.update(row['domain'].lower() for row in cursor.fetchall())
+        except pymysql.MySQLError as e:
+            print(f"Database error: {e}")
+            return [False] * len(domains)  # Assume non-duplicate on error
+        return [domain.lower() in existing for domain in domains]
+
+    def iter_domains(self, batch_size=10000):
+        """
+        Stream every domain stored in the domains table.
+        Uses an unbuffered cursor so the table is never fully loaded in memory.
+        :param batch_size: Number of rows fetched per round trip.
+        :raises pymysql.MySQLError: If the table could not be read to the end.
+        :return: Generator of domains.
+        """
         try:
-            with self.connection.cursor() as cursor:
-                for domain in domains:
-                    sql_query = f"SELECT COUNT(*) AS count FROM {self.table_domains} WHERE domain = %s"
-                    cursor.execute(sql_query, (domain,))
-                    result = cursor.fetchone()
-                    duplicate_flags.append(result['count'] > 0)
+            with self.pool.connection() as connection, connection.cursor(pymysql.cursors.SSCursor) as cursor:
+                cursor.execute(f"SELECT domain FROM {self.table_domains}")
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row[0]
         except pymysql.MySQLError as e:
             print(f"Database error: {e}")
-            duplicate_flags = [False] * len(domains)  # Assume non-duplicate on error
-        return duplicate_flags
+            raise  # The caller must know the scan is incomplete
 
-    def insert_non_duplicates(self, domains):
+    def insert_non_duplicates(self, domains, chunk_size=1000):
         """
         Insert only non-duplicate domains into the database, ignoring duplicates.
+        Each chunk is written with a single multi-row INSERT IGNORE, and the ids
+        of the rows it created are recovered with one SELECT: LAST_INSERT_ID()
+        is the first id generated by the statement, so rows of the chunk at or
+        above it were inserted by this call, unless another connection committed
+        some of the same domains meanwhile. When the SELECT finds more rows than
+        the INSERT created, the chunk is rolled back to a savepoint and inserted
+        one row at a time instead.
         :param domains: List of domains to check and insert if non-duplicate.
-        :return: Dictionary {domain: id} of successfully inserted domains.
+        :param chunk_size: Maximum number of rows per INSERT statement.
+        :return: Dictionary {domain: id} of successfully inserted domains, or None if the transaction failed.
         """
         inserted_domains_ids = {}
+        domains = list(dict.fromkeys(domains))  # Deduplicate, keeping order
         
         try:
-            with self.connection.cursor() as cursor:
-                for domain in domains:
-                    sql_query = f"INSERT IGNORE INTO {self.table_domains} (domain) VALUES (%s)"
-                    cursor.execute(sql_query, (domain,))
-                    
-                    # If lastrowid is not  0, it means the insert was successful
-                    if cursor.lastrowid:
-                        inserted_domains_ids[domain] = cursor.lastrowid
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                connection.begin()
+                for start in range(0, len(domains), chunk_size):
+                    chunk = domains[start:start + chunk_size]
+                    cursor.execute("SAVEPOINT insert_chunk")
+                    values = ', '.join(['(%s)'] * len(chunk))
+                    sql_query = f"INSERT IGNORE INTO {self.table_domains} (domain) VALUES {values}"
+                    cursor.execute(sql_query, chunk)
+                    inserted_rows = cursor.rowcount
+
+                    # Nothing was inserted, every domain in the chunk is a duplicate
+                    if inserted_rows <= 0 or not cursor.lastrowid:
+                        continue
+
+                    first_id = cursor.lastrowid
+                    placeholders = ', '.join(['%s'] * len(chunk))
+                    sql_query = f"SELECT id, domain FROM {self.table_domains} WHERE domain IN ({placeholders}) AND id >= %s"
+                    cursor.execute(sql_query, chunk + [first_id])
+                    rows = cursor.fetchall()
+
+                    if len(rows) > inserted_rows:
+                        # Another connection committed some of these domains while the INSERT ran,
+                        # so their ids are above first_id too. Redo the chunk one row at a time,
+                        # where rowcount and lastrowid tell exactly which rows are ours.
+                        cursor.execute("ROLLBACK TO SAVEPOINT insert_chunk")
+                        rows = []
+                        sql_query = f"INSERT IGNORE INTO {self.table_domains} (domain) VALUES (%s)"
+                        for domain in chunk:
+                            cursor.execute(sql_query, [domain])
+                            if cursor.rowcount > 0:
+                                rows.append({'id': cursor.lastrowid, 'domain': domain})
+
+                    for row in rows:
+                        inserted_domains_ids[row['domain']] = row['id']
                 
-                self.connection.commit()
+                connection.commit()
         
         except pymysql.MySQLError as e:
             print(f"Database error: {e}")
+            return None  # The transaction was rolled back, none of the ids exist
         
         return inserted_domains_ids
 
+    def insert_enrichment(self, ip_data, ns_data, chunk_size=1000):
+        """
+        Insert IP and nameserver rows of many domains in a single transaction.
+        Rows are written with multi-row INSERT statements of up to chunk_size rows.
+        :param ip_data: List of tuples containing (domain_id, ip).
+        :param ns_data: List of tuples containing (domain_id, ns).
+        :param chunk_size: Maximum number of rows per INSERT statement.
+        :return: True if the transaction was committed.
+        """
+        try:
+            # The pool rolls the transaction back if a statement fails
+            with self.pool.connection() as connection:
+                connection.begin()
+                with connection.cursor() as cursor:
+                    for table, column, rows in ((self.table_ips, 'ip', ip_data), (self.table_ns, 'ns', ns_data)):
+                        for start in range(0, len(rows), chunk_size):
+                            chunk = rows[start:start + chunk_size]
+                            values = ', '.join(['(%s, %s)'] * len(chunk))
+                            sql_query = f"INSERT INTO {table} (domain_id, {column}) VALUES {values}"
+                            cursor.execute(sql_query, [value for row in chunk for value in row])
+                connection.commit()
+            return True
+        except pymysql.MySQLError as e:
+            print(f"Database error: {e}")
+            return False
+
     def insert_domains_ns(self, data):
         """
         Insert nameserver (NS) data into the domains_ns table.
         :param data: List of tuples containing (domain_id, ns).
         """
         try:
-            with self.connection.cursor() as cursor:
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                connection.begin()
                 sql_query = f"""
                     INSERT INTO {self.table_ns} (domain_id, ns) 
                     VALUES (%s, %s)
                 """
                 cursor.executemany(sql_query, data)
-                self.connection.commit()
+                connection.commit()
         except pymysql.MySQLError as e:
-            self.connection.rollback()
             print(f"Database error: {e}")
 
     def insert_domains_ip(self, data):
@@ -110,13 +233,13 @@ class DBManager:
         :param data: List of tuples containing (domain_id, ip).
         """
         try:
-            with self.connection.cursor() as cursor:
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                connection.begin()
                 sql_query = f"""
                     INSERT INTO {self.table_ips} (domain_id, ip) 
                     VALUES (%s, %s)
                 """
                 cursor.executemany(sql_query, data)
-                self.connection.commit()
+                connection.commit()
         except pymysql.MySQLError as e:
-            self.connection.rollback()
             print(f"Database error: {e}")
@@ -0,0 +1,51 @@
+"""
+Load-once lookup structures built from the dictionary lists.
+The get_* functions in the generated modules return a fresh list on
+every call; the tables below are built on first use and then shared,
+so membership checks are O(1) for exact matches and O(labels) for
+suffix matches.
+"""
+
+from functools import lru_cache
+from dictionary.domain_providers import get_providers
+from dictionary.domain_tld import get_tld_blacklist
+from dictionary.domain_whitelist import get_whitelist
+from dictionary.skippable_subdomains import get_skippable
+from dictionary.suffix_trie import SuffixTrie
+from dictionary.whitelist_matcher import WhitelistMatcher
+
+
+@lru_cache(maxsize=None)
+def tld_blacklist_set():
+    """Frozenset of blacklisted public suffixes (exact match)."""
+    return frozenset(tld.strip().lower() for tld in get_tld_blacklist())
+
+
+@lru_cache(maxsize=None)
+def skippable_subdomains_set():
+    """Frozenset of service-based subdomains to skip (exact match)."""
+    return frozenset(subdomain.strip().lower() for subdomain in get_skippable())
+
+
+@lru_cache(maxsize=None)
+def whitelist_set():
+    """Frozenset of whitelisted domains (exact match)."""
+    return frozenset(domain.strip().lower() for domain in get_whitelist())
+
+
+@lru_cache(maxsize=None)
+def providers_set():
+    """Frozenset of hosting provider domains (exact match)."""
+    return frozenset(domain.strip().lower() for domain in get_providers())
+
+
+@lru_cache(maxsize=None)
+def providers_trie():
+    """SuffixTrie of hosting provider domains (host is a provider domain or under one)."""
+    return SuffixTrie(get_providers())
+
+
+@lru_cache(maxsize=None)
+def whitelist_matcher():
+    """WhitelistMatcher of whitelisted domains (host is a whitelisted domain or under one)."""
+    return WhitelistMatcher(get_whitelist())
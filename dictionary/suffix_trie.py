@@ -0,0 +1,49 @@
+"""
+Label-reversed trie used for suffix lookups on domain lists.
+A host is matched by walking its labels from the TLD inwards, so a
+lookup costs one dict access per label regardless of the list size.
+"""
+
+
+class SuffixTrie:
+    """
+    Immutable trie of domains keyed by their labels in reverse order,
+    e.g. 'pages.dev' is stored as dev -> pages.
+    """
+    _END = object()
+
+    def __init__(self, domains):
+        self._root = {}
+        self._size = 0
+        for domain in domains:
+            domain = domain.strip().lower().strip('.')
+            if not domain:
+                continue
+            node = self._root
+            for label in reversed(domain.split('.')):
+                node = node.setdefault(label, {})
+            if self._END not in node:
+                self._size += 1
+            node[self._END] = domain
+
+    def match(self, host):
+        """
+        Find the shortest entry that is equal to host or a parent domain of it.
+        :param host: Domain to look up, e.g. 'foo.pages.dev'.
+        :return: The matching entry ('pages.dev'), or None.
+        """
+        node = self._root
+        for label in reversed(host.lower().rstrip('.').split('.')):
+            node = node.get(label)
+            if node is None:
+                return None
+            entry = node.get(self._END)
+            if entry is not None:
+                return entry
+        return None
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, host):
+        return self.match(host) is not None
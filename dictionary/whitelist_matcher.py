@@ -0,0 +1,26 @@
+"""
+Fast matcher for the domain whitelist.
+The whitelist holds thousands of registrable domains, so checking a
+host with an endswith loop over every entry is far too slow at
+certstream rates. The entries are compiled once into a label-reversed
+trie, and a host is answered in O(number of labels).
+"""
+
+from dictionary.domain_whitelist import get_whitelist
+from dictionary.suffix_trie import SuffixTrie
+
+
+class WhitelistMatcher(SuffixTrie):
+    @classmethod
+    def from_dictionary(cls):
+        """Builds a matcher from dictionary/domain_whitelist.py."""
+        return cls(get_whitelist())
+
+    def filter_whitelisted(self, hosts):
+        """
+        Returns the hosts that fall under a whitelisted domain.
+        :param hosts: Iterable of normalized hosts.
+        :return: List of matching hosts, in input order.
+        """
+        match = self.match
+        return [host for host in hosts if match(host) is not None]
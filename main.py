@@ -2,21 +2,29 @@ import asyncio
 import time
 from a_certs_firehose.a_certs_firehose import ACertsFirehose
 from b_certs_filtering.b_certs_filtering import BCertsFiltering
+from b_certs_filtering.recent_domains_cache import RecentDomainsCache
 from c_dns_multiplexer.c_dns_multiplexer import CDNSMultiplexer
-from db_manager.db_manager import DBManager
+from d_storage_distribution.db_write_buffer import DBWriteBuffer
+from db_manager.async_db_manager import create_db_manager
 from dotenv import load_dotenv
+from pipeline_queues.queue_batcher import QueueBatcher
 from pulsar_producer.pulsar_producer import PulsarProducer
-import json
+import os
 
 load_dotenv()
 
 # Global Pulsar producer instance
 pulsar_producer = PulsarProducer()
 
-# Global database instance
-db_manager = DBManager()
-# Initialize the database connection once at startup
-db_manager.init_connection()
+# Global database instance, its connection pool is shared by process_b and process_d.
+# DB_DRIVER picks native asyncio (aiomysql) or pymysql on threads; both are awaited.
+db_manager = create_db_manager()
+
+# Global cache of recently seen domains, shared with process_b
+recent_domains_cache = RecentDomainsCache(
+    max_size=int(os.getenv("RECENT_DOMAINS_CACHE_SIZE", "100000")),
+    ttl=float(os.getenv("RECENT_DOMAINS_CACHE_TTL", "600")),
+)
 
 # Tracking counters
 cert_counter = [0]
@@ -30,74 +38,84 @@ async def process_a(queue_ab, cert_counter):
 
 # Process B: Domains filtering
 async def process_b(queue_ab, queue_bc):
-    b_certs_filtering = BCertsFiltering(queue_bc)
+    b_certs_filtering = BCertsFiltering(queue_bc, recent_domains_cache, db_manager)
+    await b_certs_filtering.start()
+    # Coalesce certificates into batches of up to FILTER_BATCH_SIZE domains,
+    # waiting at most FILTER_BATCH_MAX_DELAY_MS after the first one
+    batcher = QueueBatcher(
+        queue_ab,
+        max_size=int(os.getenv("FILTER_BATCH_SIZE", "500")),
+        max_delay=int(os.getenv("FILTER_BATCH_MAX_DELAY_MS", "200")) / 1000,
+        size_of=len,
+    )
     while True:
-        all_domains = await queue_ab.get()  # Wait for next item in queue
-        b_certs_filtering.filter(all_domains)
+        certs_domains = await batcher.next_batch()  # Wait for next batch of certificates
+        all_domains = [domain for cert_domains in certs_domains for domain in cert_domains]
+        # Database work runs off the event loop, with a bounded number of batches in flight
+        await b_certs_filtering.submit(all_domains)
         # Increment the filtered domain counter
         filtered_counter[0] += len(all_domains)
-        queue_ab.task_done()  # Mark item as processed
 
 # Process C: Enriching domains with IPs and NS using CDNSMultiplexer
-async def process_c(queue_bc, queue_cd, batch_size=4000):
+async def process_c(queue_bc, queue_cd, c_dns_multiplexer):
     print("Starting process_c")
-    c_dns_multiplexer = CDNSMultiplexer()
-    while True:
-        batch = {}
-        
-        # Collect exactly batch_size items from queue_bc
-        for _ in range(batch_size):
-            domains_and_ids = await queue_bc.get()  # Waits for each item
-            batch.update(domains_and_ids)
+    await c_dns_multiplexer.start(queue_cd)
+    try:
+        while True:
+            domain_batch = await queue_bc.get()  # Waits for each DomainBatch
+            for domain_id, domain in domain_batch:
+                await c_dns_multiplexer.submit(domain_id, domain)
             queue_bc.task_done()  # Mark item as processed
+    finally:
+        await c_dns_multiplexer.stop()
 
-        # Start time for processing rate calculation
-        start_time = time.time()
+# Process D: Save final values (IPs and NS) to the database
+async def publish_after_commit(enriched_batch, commit_future, publish_slots):
+    """
+    Sends the domains and ids of a batch to Pulsar once the flush holding its IP and NS
+    rows has completed, so consumers of the topic can read those rows by id.
+    """
+    try:
+        await commit_future
+        # Send domains and ids to Pulsar, in the configured PULSAR_MESSAGE_FORMAT
+        await pulsar_producer.publish_domains(enriched_batch.ids, enriched_batch.domains)
+    except Exception as e:
+        print(f"Failed to send to Pulsar: {e}")
+    finally:
+        publish_slots.release()
 
-        # Process the batch once the exact batch size is reached
-        await c_dns_multiplexer.enrich_domains(batch, queue_cd)
-        
-        # End time for processing rate calculation
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        
-        # Update enriched domain counter
-        enriched_counter[0] += len(batch)
-        
-        # Optional debugging output
-        print(f"Processed batch of size {len(batch)} in {elapsed_time:.2f} seconds.")
 
-# Process D: Save final values (IPs and NS) to the database
-async def process_d(queue_cd):
+async def process_d(queue_cd, db_write_buffer):
     """
     Process D: Enriches domain data with IPs and NS, then sends the domain and ID to Pulsar.
+    IP and NS rows go through the write-behind buffer, which commits many domains at once.
+    A batch is published only after its rows were committed, asynchronously, waiting only
+    when PULSAR_MAX_INFLIGHT_BATCHES batches are waiting for their commit or for Pulsar.
     """
-    while True:
-        enriched_data = await queue_cd.get()  # Consume enriched data from queue_cd
-        
-        # Extract IP and NS data to prepare for batch database insertion
-        ip_data = [(enriched_data["id"], ip) for ip in enriched_data["ips"]]
-        ns_data = [(enriched_data["id"], ns) for ns in enriched_data["ns"]]
-
-        # Insert IPs and NS records if they exist
-        if ip_data:
-            db_manager.insert_domains_ip(ip_data)
-        if ns_data:
-            db_manager.insert_domains_ns(ns_data)
-
-        # Send domain and id to Pulsar
-        try:
-            domain_message = json.dumps({
-                "id": enriched_data["id"],
-                "domain": enriched_data["domain"]
-            })
-            pulsar_producer.send(domain_message)
-        except Exception as e:
-            print(f"Failed to send to Pulsar: {e}")
+    publish_slots = asyncio.Semaphore(int(os.getenv("PULSAR_MAX_INFLIGHT_BATCHES", "100")))
+    publish_tasks = set()
+    await db_write_buffer.start()
+    try:
+        while True:
+            enriched_batch = await queue_cd.get()  # Consume an EnrichedBatch from queue_cd
+
+            # Buffer the IP and NS rows of the whole batch for database insertion
+            await publish_slots.acquire()
+            commit_future = await db_write_buffer.add(enriched_batch.ip_rows(), enriched_batch.ns_rows())
+
+            # Publish once the flush holding the rows is done, without holding up the next batch
+            task = asyncio.create_task(publish_after_commit(enriched_batch, commit_future, publish_slots))
+            publish_tasks.add(task)
+            task.add_done_callback(publish_tasks.discard)
+    finally:
+        # Write the rows still buffered, publish their batches and wait for pending acks before shutting down
+        await db_write_buffer.close()
+        await asyncio.gather(*publish_tasks, return_exceptions=True)
+        await pulsar_producer.flush()
 
 
 # Process E: Display statistics for queue sizes and domain counts per second (5-minute rolling average)
-async def process_e(queue_ab, queue_bc, queue_cd, cert_counter, lapse=1, rolling_window=300):
+async def process_e(queue_ab, queue_bc, queue_cd, cert_counter, c_dns_multiplexer, db_write_buffer, lapse=1, rolling_window=300):
     # Initialize lists to store the last `rolling_window` seconds of data
     cert_history = []
     filtered_history = []
@@ -140,6 +158,11 @@ async def process_e(queue_ab, queue_bc, queue_cd, cert_counter, lapse=1, rolling
             print(f"Certs received per second ({(rolling_window/60):.0f}-min avg): {certs_per_sec_avg:.2f}")
             print(f"Domains filtered per second ({(rolling_window/60):.0f}-min avg): {filtered_per_sec_avg:.2f}")
             print(f"Domains enriched per second ({(rolling_window/60):.0f}-min avg): {enriched_per_sec_avg:.2f}")
+            print(f"Recent domains cache: {len(recent_domains_cache)} entries, {recent_domains_cache.hits} hits, {recent_domains_cache.misses} misses, hit rate {recent_domains_cache.hit_rate:.2%}")
+            print("DNS: " + ", ".join(f"{key}={value}" for key, value in c_dns_multiplexer.stats().items()))
+            print(f"Pulsar: {pulsar_producer.sent} sent, {pulsar_producer.acked} acked, {pulsar_producer.failed} failed, {len(pulsar_producer.pending_futures)} pending")
+            print(f"DB writes: {db_write_buffer.rows_written} rows in {db_write_buffer.flushes} flushes, {db_write_buffer.rows_failed} failed, {len(db_write_buffer)} pending")
+            print("DB pool: " + ", ".join(f"{key}={value}" for key, value in db_manager.stats().items()))
             print("==========================================================")
             
             # Update the last display time
@@ -152,19 +175,48 @@ async def process_e(queue_ab, queue_bc, queue_cd, cert_counter, lapse=1, rolling
 
 
 async def main():
+    # Initialize the database connection pool once at startup
+    await db_manager.init_connection()
+
     # Initialize queues and counters
     queue_ab = asyncio.Queue(maxsize=1000)
-    queue_bc = asyncio.Queue(maxsize=50000)
-    queue_cd = asyncio.Queue(maxsize=1000)
+    queue_bc = asyncio.Queue(maxsize=100)    # DomainBatch items of up to FILTER_BATCH_SIZE domains
+    queue_cd = asyncio.Queue(maxsize=10)     # EnrichedBatch items of up to DNS_RESULT_BATCH_SIZE domains
+
+    # DNS multiplexer used by process_c: a fixed pool of DNS_WORKERS resolver
+    # workers; domains are handed over as they arrive, and submit() waits when the
+    # workers fall behind. Built here, so its queue and locks belong to the running loop.
+    c_dns_multiplexer = CDNSMultiplexer(
+        num_workers=int(os.getenv("DNS_WORKERS", "500")),
+        pending_size=int(os.getenv("DNS_PENDING_SIZE", "1000")),
+        enriched_counter=enriched_counter,
+    )
+
+    # Write-behind buffer of IP and NS rows, flushed by process_d (its flush lock
+    # must belong to the running loop too)
+    db_write_buffer = DBWriteBuffer(db_manager)
 
     # Run all processes concurrently
     await asyncio.gather(
         process_a(queue_ab, cert_counter),
         process_b(queue_ab, queue_bc),
-        process_c(queue_bc, queue_cd),
-        process_d(queue_cd),
-        process_e(queue_ab, queue_bc, queue_cd, cert_counter),
+        process_c(queue_bc, queue_cd, c_dns_multiplexer),
+        process_d(queue_cd, db_write_buffer),
+        process_e(queue_ab, queue_bc, queue_cd, cert_counter, c_dns_multiplexer, db_write_buffer),
     )
 
+def install_event_loop_policy():
+    """Switches asyncio to uvloop when USE_UVLOOP=1 and uvloop is installed."""
+    if os.getenv("USE_UVLOOP", "0") != "1":
+        return
+    try:
+        import uvloop
+    except ImportError:
+        print("USE_UVLOOP=1 but uvloop is not installed, using the default event loop")
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
 if __name__ == '__main__':
+    install_event_loop_policy()
     asyncio.run(main())
@@ -0,0 +1,59 @@
+"""
+Columnar batch records passed between pipeline stages.
+Instead of one dict per domain, each queue item carries a batch of
+domains as parallel lists, so a single queue operation moves hundreds
+of domains and far fewer small objects are created per domain.
+"""
+
+
+class DomainBatch:
+    """New domains and their database ids, from the filtering stage to the DNS stage."""
+
+    __slots__ = ("ids", "domains")
+
+    def __init__(self, ids=None, domains=None):
+        self.ids = ids if ids is not None else []
+        self.domains = domains if domains is not None else []
+
+    @classmethod
+    def from_mapping(cls, domains_ids):
+        """
+        :param domains_ids: Dictionary of domains (keys) and their ids (values).
+        """
+        return cls(list(domains_ids.values()), list(domains_ids.keys()))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        """Yields (id, domain) pairs."""
+        return zip(self.ids, self.domains)
+
+
+class EnrichedBatch:
+    """Resolved domains, from the DNS stage to the storage stage."""
+
+    __slots__ = ("ids", "domains", "ips", "nameservers")
+
+    def __init__(self):
+        self.ids = []
+        self.domains = []
+        self.ips = []          # One list of IPv4 addresses per domain
+        self.nameservers = []  # One list of nameservers per domain
+
+    def append(self, domain_id, domain, ips, nameservers):
+        self.ids.append(domain_id)
+        self.domains.append(domain)
+        self.ips.append(ips)
+        self.nameservers.append(nameservers)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def ip_rows(self):
+        """Returns (domain id, ip) tuples for every IP in the batch."""
+        return [(domain_id, ip) for domain_id, ips in zip(self.ids, self.ips) for ip in ips]
+
+    def ns_rows(self):
+        """Returns (domain id, nameserver) tuples for every nameserver in the batch."""
+        return [(domain_id, ns) for domain_id, nameservers in zip(self.ids, self.nameservers) for ns in nameservers]
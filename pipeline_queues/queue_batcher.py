@@ -0,0 +1,54 @@
+"""
+Size-or-deadline batching on top of asyncio queues.
+Stages that pay a fixed cost per call (a database transaction, a DNS
+burst) drain their input queue into batches, flushing when the batch
+reaches max_size or when max_delay has passed since its first item,
+whichever comes first.
+"""
+
+import asyncio
+
+
+class QueueBatcher:
+    def __init__(self, queue, max_size, max_delay, size_of=None):
+        """
+        :param queue: asyncio.Queue to drain.
+        :param max_size: Flush once the batch holds this many units.
+        :param max_delay: Seconds to wait after the first item before flushing a partial batch.
+        :param size_of: Function returning the number of units in an item (default: 1 per item).
+        """
+        self.queue = queue
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.size_of = size_of
+
+    def _take(self, item, items):
+        self.queue.task_done()
+        items.append(item)
+        return self.size_of(item) if self.size_of else 1
+
+    async def next_batch(self):
+        """
+        Waits for at least one item, then keeps draining until the batch is full
+        or the deadline is reached.
+        :return: List of queue items, in arrival order.
+        """
+        loop = asyncio.get_running_loop()
+        items = []
+        size = self._take(await self.queue.get(), items)
+        deadline = loop.time() + self.max_delay
+
+        while size < self.max_size:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            size += self._take(item, items)
+
+        return items
@@ -0,0 +1,38 @@
+"""
+Message formats for the domains topic, selected with PULSAR_MESSAGE_FORMAT:
+- json: one UTF-8 JSON object {"id", "domain"} per domain (default).
+- avro: one Avro DomainMessage per domain, with the schema registered
+  in the Pulsar schema registry so consumers can decode it.
+- avro-batch: one Avro DomainBatchMessage envelope per enriched batch,
+  holding parallel arrays of ids and domains.
+The Avro formats need fastavro (pip install pulsar-client[avro]).
+"""
+
+from pulsar.schema import Array, BytesSchema, Long, Record, String
+
+MESSAGE_FORMATS = ('json', 'avro', 'avro-batch')
+
+
+class DomainMessage(Record):
+    _avro_namespace = 'watchdog_intake'
+    id = Long(required=True)
+    domain = String(required=True)
+
+
+class DomainBatchMessage(Record):
+    _avro_namespace = 'watchdog_intake'
+    ids = Array(Long(), required=True)
+    domains = Array(String(), required=True)
+
+
+def schema_for(message_format):
+    """
+    Returns the Pulsar schema the producer is created with for a message format.
+    :raises ValueError: If the format is unknown.
+    """
+    if message_format not in MESSAGE_FORMATS:
+        raise ValueError(f"Unknown PULSAR_MESSAGE_FORMAT: {message_format}")
+    if message_format == 'json':
+        return BytesSchema()
+    from pulsar.schema import AvroSchema  # Only defined when fastavro is installed
+    return AvroSchema(DomainBatchMessage if message_format == 'avro-batch' else DomainMessage)
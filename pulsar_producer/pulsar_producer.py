@@ -1,10 +1,31 @@
+import asyncio
+import json
 import pulsar
 import os
 from dotenv import load_dotenv
+from pulsar_producer.message_schema import DomainBatchMessage, DomainMessage, schema_for
 
 # Load environment variables from .env file
 load_dotenv()
 
+COMPRESSION_TYPES = {
+    'none': pulsar.CompressionType.NONE,
+    'lz4': pulsar.CompressionType.LZ4,
+    'zstd': pulsar.CompressionType.ZSTD,
+    'zlib': pulsar.CompressionType.ZLib,
+    'snappy': pulsar.CompressionType.SNAPPY,
+}
+
+
+class PulsarPublishError(Exception):
+    """Raised when the broker did not acknowledge a message."""
+
+
+def _retrieve_exception(future):
+    # Failures are already reported by the ack callback, callers may ignore the future
+    if not future.cancelled():
+        future.exception()
+
 class PulsarProducer:
     def __init__(self):
         """
@@ -23,8 +44,29 @@ class PulsarProducer:
             # Create a Pulsar client
             self.client = pulsar.Client(pulsar_url)
 
-            # Create a producer on the specified topic
-            self.producer = self.client.create_producer(topic)
+            # Create a producer on the specified topic. Messages are batched and
+            # compressed client side, and at most max_pending are awaiting an ack.
+            self.max_pending = int(os.getenv('PULSAR_MAX_PENDING', '10000'))
+            self.message_format = os.getenv('PULSAR_MESSAGE_FORMAT', 'json').lower()
+            self.producer = self.client.create_producer(
+                topic,
+                schema=schema_for(self.message_format),
+                batching_enabled=os.getenv('PULSAR_BATCHING', '1') == '1',
+                batching_max_messages=int(os.getenv('PULSAR_BATCH_MAX_MESSAGES', '1000')),
+                batching_max_publish_delay_ms=int(os.getenv('PULSAR_BATCH_MAX_DELAY_MS', '10')),
+                compression_type=COMPRESSION_TYPES[os.getenv('PULSAR_COMPRESSION', 'lz4').lower()],
+                max_pending_messages=self.max_pending,
+                block_if_queue_full=True,
+            )
+
+            # Window of messages sent with send_async and not acknowledged yet.
+            # Created on the first send, inside the running loop: the producer is
+            # built at import time, before asyncio.run() starts.
+            self.pending_window = None
+            self.pending_futures = set()
+            self.sent = 0
+            self.acked = 0
+            self.failed = 0
 
             print(f"Pulsar Producer: {self.producer}")
 
@@ -45,6 +87,77 @@ class PulsarProducer:
         except Exception as e:
             print(f"Error sending message to Pulsar: {e}")
 
+    async def send_async(self, message):
+        """
+        Queues a message for publishing without waiting for the broker ack.
+        Waits only while PULSAR_MAX_PENDING messages are still unacknowledged,
+        so the event loop never blocks on the producer queue.
+        :param message: The message to send.
+        :return: asyncio.Future resolved with the message id once the broker acks it.
+        :raises PulsarPublishError: Through the future, if the broker rejects the message.
+        """
+        return await self._send_content_async(message.encode('utf-8'))
+
+    async def publish_domains(self, ids, domains):
+        """
+        Publishes (id, domain) pairs in the configured PULSAR_MESSAGE_FORMAT:
+        one message per domain for json and avro, or a single envelope for avro-batch.
+        :param ids: Domain ids.
+        :param domains: Domains, in the same order as ids.
+        """
+        if self.message_format == 'avro-batch':
+            await self._send_content_async(DomainBatchMessage(ids=list(ids), domains=list(domains)))
+        elif self.message_format == 'avro':
+            for domain_id, domain in zip(ids, domains):
+                await self._send_content_async(DomainMessage(id=domain_id, domain=domain))
+        else:
+            for domain_id, domain in zip(ids, domains):
+                await self._send_content_async(json.dumps({"id": domain_id, "domain": domain}).encode('utf-8'))
+
+    async def _send_content_async(self, content):
+        """Sends bytes or a schema Record, see send_async."""
+        if self.pending_window is None:
+            self.pending_window = asyncio.Semaphore(self.max_pending)
+        await self.pending_window.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(_retrieve_exception)
+
+        def callback(result, message_id):
+            # Runs on a Pulsar client thread
+            loop.call_soon_threadsafe(self._on_ack, future, result, message_id)
+
+        try:
+            self.producer.send_async(content, callback)
+        except Exception:
+            self.pending_window.release()
+            raise
+        self.sent += 1
+        self.pending_futures.add(future)
+        return future
+
+    def _on_ack(self, future, result, message_id):
+        self.pending_window.release()
+        self.pending_futures.discard(future)
+        if future.done():
+            return
+        if result == pulsar.Result.Ok:
+            self.acked += 1
+            future.set_result(message_id)
+        else:
+            self.failed += 1
+            print(f"Error sending message to Pulsar: {result}")
+            future.set_exception(PulsarPublishError(str(result)))
+
+    async def flush(self):
+        """
+        Publishes the messages batched so far and waits until every message
+        sent with send_async is acknowledged or failed.
+        """
+        await asyncio.to_thread(self.producer.flush)
+        if self.pending_futures:
+            await asyncio.gather(*self.pending_futures, return_exceptions=True)
+
     def close(self):
         """
         Closes the Pulsar client and producer.
@@ -0,0 +1,99 @@
+"""
+In-process fake DNS server for the resolver backend tests.
+It listens on UDP and TCP on the same ephemeral port of 127.0.0.1, and
+the first label of the question picks the reply:
+
+- nx.*: NXDOMAIN.
+- big.*: truncated (TC) over UDP, 60 A records over TCP.
+- bad.*: a reply with the right message id but a cut-off answer.
+- anything else: one A record, after a random delay so that concurrent
+  replies come back out of order.
+"""
+
+import asyncio
+import random
+import struct
+
+_HEADER = struct.Struct('!HHHHHH')
+
+
+def encode_name(name):
+    encoded = b''.join(bytes([len(label)]) + label.encode('ascii') for label in name.rstrip('.').split('.'))
+    return encoded + b'\x00'
+
+
+def a_record(ip, ttl=300):
+    # Owner name is a compression pointer to the question at offset 12
+    return b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, ttl, 4) + bytes(int(part) for part in ip.split('.'))
+
+
+def build_reply(query, tcp=False):
+    query_id, _flags, _qdcount, _ancount, _nscount, _arcount = _HEADER.unpack_from(query, 0)
+    offset = _HEADER.size
+    labels = []
+    while query[offset]:
+        length = query[offset]
+        labels.append(query[offset + 1:offset + 1 + length].decode('ascii'))
+        offset += 1 + length
+    question = query[_HEADER.size:offset + 5]
+    first_label = labels[0] if labels else ''
+
+    flags = 0x8180  # Response, recursion desired and available
+    answers = []
+    if first_label == 'nx':
+        flags |= 3
+    elif first_label == 'big' and not tcp:
+        flags |= 0x0200
+    elif first_label == 'big':
+        answers = [a_record(f"10.0.0.{i}") for i in range(60)]
+    elif first_label == 'bad':
+        return _HEADER.pack(query_id, flags, 1, 1, 0, 0) + question + b'\xc0\x0c\x00'
+    else:
+        answers = [a_record("192.0.2.1")]
+    return _HEADER.pack(query_id, flags, 1, len(answers), 0, 0) + question + b''.join(answers)
+
+
+class _UDPServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server.udp_queries += 1
+        delay = random.uniform(0, 0.02)
+        asyncio.get_running_loop().call_later(delay, self.transport.sendto, build_reply(data), addr)
+
+
+class FakeDNSServer:
+    def __init__(self):
+        self.host = "127.0.0.1"
+        self.port = None
+        self.udp_queries = 0
+        self.tcp_queries = 0
+        self.transport = None
+        self.tcp_server = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.transport, _protocol = await loop.create_datagram_endpoint(
+            lambda: _UDPServerProtocol(self), local_addr=(self.host, 0)
+        )
+        self.port = self.transport.get_extra_info('sockname')[1]
+        self.tcp_server = await asyncio.start_server(self._handle_tcp, self.host, self.port)
+        return self
+
+    async def close(self):
+        self.transport.close()
+        self.tcp_server.close()
+        await self.tcp_server.wait_closed()
+
+    async def _handle_tcp(self, reader, writer):
+        self.tcp_queries += 1
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+        reply = build_reply(await reader.readexactly(length), tcp=True)
+        writer.write(struct.pack('!H', len(reply)) + reply)
+        await writer.drain()
+        writer.close()
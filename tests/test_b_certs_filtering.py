@@ -0,0 +1,132 @@
+import asyncio
+import os
+import tldextract
+from b_certs_filtering.b_certs_filtering import BCertsFiltering
+from db_manager.bloom_filter import ScalableBloomFilter
+from dictionary.domain_tld import get_tld_blacklist
+from dictionary.skippable_subdomains import get_skippable
+
+
+def four_pass_filter(domains_in):
+    # The filters as they ran before the predicate chain: multi-level, restricted
+    # TLDs, wildcard/www stripping with deduplication, then service subdomains
+    domains = [domain for domain in domains_in if len(tldextract.extract(domain).subdomain.split('.')) <= 1]
+    skippable_tlds = get_tld_blacklist()
+    domains = [domain for domain in domains if tldextract.extract(domain).suffix.lower() not in skippable_tlds]
+    unique_domains = set()
+    for domain in domains:
+        if domain.startswith('*.'):
+            domain = domain[2:]
+        if domain.startswith('www.'):
+            domain = domain[4:]
+        unique_domains.add(domain)
+    skippable_subdomains = get_skippable()
+    return [domain for domain in unique_domains if tldextract.extract(domain).subdomain.lower() not in skippable_subdomains]
+
+
+def make_filtering():
+    async def build():
+        # The database is never reached by _filter_parsed
+        return BCertsFiltering(asyncio.Queue(), db_manager=object())
+    return asyncio.run(build())
+
+
+CASES = [
+    # Plain and single-level domains
+    ['example.com'],
+    ['shop.example.com'],
+    ['example.co.uk', 'shop.example.co.uk'],
+    # Wildcard and www prefixes, alone, combined and colliding with the bare domain
+    ['*.example.com'],
+    ['www.example.com'],
+    ['*.www.example.com'],
+    ['example.com', 'www.example.com', '*.example.com'],
+    ['*.shop.example.com', 'shop.example.com'],
+    ['www.com'],
+    # Multi-level names, depth counted on the raw name
+    ['a.b.example.com'],
+    ['*.a.example.com'],
+    ['www.a.example.com'],
+    ['a.b.c.example.co.uk'],
+    # Blacklisted suffixes
+    ['army.mil', 'www.army.mil', 'shop.example.com.post'],
+    ['example.MIL'],
+    # Skippable service subdomains
+    ['mail.example.com', 'ftp.example.org', 'cpanel.example.net'],
+    ['MAIL.example.com'],
+    ['*.mail.example.com', 'www.mail.example.com'],
+    # A mix of everything in one certificate batch
+    [
+        'example.com', '*.example.com', 'www.example.com', 'mail.example.com',
+        'a.b.example.com', 'army.mil', 'shop.example.org', 'shop.example.org',
+        '*.example.net', 'webmail.example.net', 'example.io',
+    ],
+]
+
+
+def test_predicate_chain_matches_the_four_pass_filters():
+    filtering = make_filtering()
+    for domains in CASES:
+        filtered = filtering._filter_parsed(domains)
+        assert len(filtered) == len(set(filtered)), domains
+        assert set(filtered) == set(four_pass_filter(domains)), domains
+
+
+def test_predicate_chain_keeps_first_seen_order():
+    filtering = make_filtering()
+    domains = ['www.b.com', 'a.com', '*.b.com', 'c.com', 'a.com']
+    assert filtering._filter_parsed(domains) == ['b.com', 'a.com', 'c.com']
+
+
+class SlowTableDBManager:
+    # Domains table whose scan only finishes once scan_done is set
+    def __init__(self, stored):
+        self.stored = dict.fromkeys(stored)
+        self.scan_done = asyncio.Event()
+
+    async def init_connection(self):
+        pass
+
+    async def iter_domains(self, batch_size=10000):
+        yield next(iter(self.stored))
+        await self.scan_done.wait()
+        for domain in list(self.stored)[1:]:
+            yield domain
+
+    async def find_duplicates(self, domains, chunk_size=1000):
+        return [domain in self.stored for domain in domains]
+
+    async def insert_non_duplicates(self, domains, chunk_size=1000):
+        inserted = {}
+        for domain in domains:
+            if domain not in self.stored:
+                self.stored[domain] = None
+                inserted[domain] = len(self.stored)
+        return inserted
+
+
+def test_start_filters_while_the_bloom_filter_warms_up(tmp_path):
+    async def scenario():
+        db_manager = SlowTableDBManager(['a.com', 'b.com'])
+        queue_bc = asyncio.Queue()
+        filtering = BCertsFiltering(queue_bc, db_manager=db_manager)
+        filtering.bloom_path = str(tmp_path / 'known.bloom')
+
+        # start() returns while the table scan is still running
+        await asyncio.wait_for(filtering.start(), 1)
+        await asyncio.sleep(0)
+        assert not filtering.warmup_task.done()
+        assert not filtering.known_domains_complete
+
+        # Domains missing from the partial filter still go through INSERT IGNORE
+        await filtering.filter(['b.com', 'c.com'])
+        assert queue_bc.get_nowait().domains == ['c.com']
+        assert not os.path.exists(filtering.bloom_path)
+
+        db_manager.scan_done.set()
+        await filtering.warmup_task
+        assert filtering.known_domains_complete
+        saved = ScalableBloomFilter.load(filtering.bloom_path)
+        assert all(domain in saved for domain in ('a.com', 'b.com', 'c.com'))
+
+    asyncio.run(scenario())
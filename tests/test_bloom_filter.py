@@ -0,0 +1,71 @@
+import pytest
+from db_manager.bloom_filter import ScalableBloomFilter
+
+
+def test_filter_grows_new_slices_and_keeps_every_domain():
+    bloom = ScalableBloomFilter(initial_capacity=100, error_rate=0.01)
+    domains = [f"domain{i}.com" for i in range(1000)]
+    bloom.update(domains)
+
+    # 100 + 200 + 400 is not enough for 1000 domains, a fourth slice is added
+    assert len(bloom.slices) == 4
+    assert [bloom_slice.capacity for bloom_slice in bloom.slices] == [100, 200, 400, 800]
+    assert bloom.slices[1].error_rate == pytest.approx(0.01 * 0.9)
+    assert all(domain in bloom for domain in domains)
+    assert 'DOMAIN1.com' in bloom
+
+    # The false positive rate stays near the target as the filter grows
+    false_positives = sum(f"other{i}.org" in bloom for i in range(10000))
+    assert false_positives < 10000 * 0.05
+
+
+def test_add_reports_new_domains_and_marks_the_filter_dirty():
+    bloom = ScalableBloomFilter(initial_capacity=10)
+    assert not bloom.dirty
+    assert bloom.add('example.com')
+    assert not bloom.add('example.com')
+    assert bloom.dirty
+    assert len(bloom) == 1
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / 'known.bloom')
+    bloom = ScalableBloomFilter(initial_capacity=50, error_rate=0.001)
+    domains = [f"domain{i}.com" for i in range(200)]
+    bloom.update(domains)
+    bloom.save(path)
+    assert not bloom.dirty
+
+    loaded = ScalableBloomFilter.load(path)
+    assert not loaded.dirty
+    assert len(loaded) == len(bloom)
+    assert [s.capacity for s in loaded.slices] == [s.capacity for s in bloom.slices]
+    assert [s.bits for s in loaded.slices] == [s.bits for s in bloom.slices]
+    assert all(domain in loaded for domain in domains)
+    assert list(tmp_path.iterdir()) == [tmp_path / 'known.bloom']  # No temporary file left behind
+
+
+def test_copy_is_independent():
+    bloom = ScalableBloomFilter(initial_capacity=10)
+    bloom.add('a.com')
+    snapshot = bloom.copy()
+    bloom.update(f"domain{i}.com" for i in range(50))
+    assert len(snapshot) == 1
+    assert len(snapshot.slices) == 1
+    assert 'a.com' in snapshot
+
+
+def test_load_rejects_truncated_and_foreign_files(tmp_path):
+    path = tmp_path / 'known.bloom'
+    bloom = ScalableBloomFilter(initial_capacity=1000)
+    bloom.update(f"domain{i}.com" for i in range(100))
+    bloom.save(str(path))
+
+    data = path.read_bytes()
+    path.write_bytes(data[:-10])
+    with pytest.raises(ValueError, match='truncated'):
+        ScalableBloomFilter.load(str(path))
+
+    path.write_bytes(b'XXXX' + data[4:])
+    with pytest.raises(ValueError, match='not a bloom filter'):
+        ScalableBloomFilter.load(str(path))
@@ -0,0 +1,45 @@
+import asyncio
+
+from c_dns_multiplexer.c_dns_multiplexer import CDNSMultiplexer
+from c_dns_multiplexer.resolver_backends import DNSQueryError, DNSResolverBackend
+
+
+class FailingBackend(DNSResolverBackend):
+    async def query(self, name, record_type):
+        raise DNSQueryError("timed out")
+
+
+def test_domain_out_of_requeues_is_emitted_with_empty_results(monkeypatch):
+    monkeypatch.setenv("DNS_RETRY_ATTEMPTS", "1")
+    monkeypatch.setenv("DNS_CACHE_SIZE", "0")
+    monkeypatch.setenv("DNS_MAX_REQUEUES", "0")
+
+    async def test():
+        queue_cd = asyncio.Queue()
+        multiplexer = CDNSMultiplexer(num_workers=1, backend=FailingBackend())
+        await multiplexer.start(queue_cd)
+        await multiplexer.submit(7, "example.com")
+        await multiplexer.pending.join()
+        await multiplexer.stop()
+        batch = queue_cd.get_nowait()
+        assert (batch.ids, batch.domains, batch.ips, batch.nameservers) == ([7], ["example.com"], [[]], [[]])
+        assert multiplexer.stats()["unresolved"] == 1
+    asyncio.run(test())
+
+
+def test_domain_is_emitted_when_the_retry_queue_is_full(monkeypatch):
+    monkeypatch.setenv("DNS_RETRY_ATTEMPTS", "1")
+    monkeypatch.setenv("DNS_CACHE_SIZE", "0")
+    monkeypatch.setenv("DNS_RETRY_QUEUE_SIZE", "1")
+
+    async def test():
+        queue_cd = asyncio.Queue()
+        multiplexer = CDNSMultiplexer(num_workers=1, backend=FailingBackend())
+        await multiplexer.start(queue_cd)
+        await multiplexer.submit(1, "a.example")
+        await multiplexer.submit(2, "b.example")
+        await multiplexer.pending.join()
+        await multiplexer.stop()
+        assert [entry[2] for entry in multiplexer.retry_queue] == [1]
+        assert queue_cd.get_nowait().ids == [2]
+    asyncio.run(test())
@@ -0,0 +1,125 @@
+import itertools
+import threading
+import time
+
+import pymysql
+import pytest
+from pymysql.constants.SERVER_STATUS import SERVER_STATUS_AUTOCOMMIT, SERVER_STATUS_IN_TRANS
+
+from db_manager.connection_pool import ConnectionPool, PoolTimeoutError
+
+_thread_ids = itertools.count(1)
+
+
+class FakeConnection:
+    """Tracks the calls the pool makes on a pymysql connection."""
+
+    def __init__(self):
+        self.server_status = SERVER_STATUS_AUTOCOMMIT
+        self.open = True
+        self.rollbacks = 0
+        self.stale = False
+        self._thread_id = next(_thread_ids)
+
+    def begin(self):
+        self.server_status |= SERVER_STATUS_IN_TRANS
+
+    def commit(self):
+        self.server_status &= ~SERVER_STATUS_IN_TRANS
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.server_status &= ~SERVER_STATUS_IN_TRANS
+
+    def thread_id(self):
+        return self._thread_id
+
+    def ping(self, reconnect=True):
+        if self.stale:
+            self._thread_id = next(_thread_ids)
+            self.stale = False
+
+    def close(self):
+        self.open = False
+
+
+def test_connections_are_reused_and_bounded():
+    pool = ConnectionPool(FakeConnection, max_size=2, timeout=0.1)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    with pool.connection(), pool.connection():
+        with pytest.raises(PoolTimeoutError):
+            with pool.connection():
+                pass
+    assert pool.size == 2
+
+
+def test_transaction_left_open_is_rolled_back_on_release():
+    pool = ConnectionPool(FakeConnection, max_size=1)
+    with pool.connection() as connection:
+        connection.begin()  # Never committed
+    assert connection.rollbacks == 1
+    assert not connection.server_status & SERVER_STATUS_IN_TRANS
+
+    with pool.connection() as connection:
+        connection.begin()
+        connection.commit()
+    assert connection.rollbacks == 1  # Nothing to roll back after a commit
+
+
+def test_error_rolls_back_and_keeps_the_connection():
+    pool = ConnectionPool(FakeConnection, max_size=1)
+    with pytest.raises(pymysql.IntegrityError):
+        with pool.connection() as connection:
+            connection.begin()
+            raise pymysql.IntegrityError(1062, "Duplicate entry")
+    assert connection.rollbacks == 1
+    with pool.connection() as reused:
+        assert reused is connection
+
+
+def test_connection_level_error_discards_the_connection():
+    pool = ConnectionPool(FakeConnection, max_size=1)
+    with pytest.raises(pymysql.OperationalError):
+        with pool.connection() as connection:
+            raise pymysql.OperationalError(2013, "Lost connection")
+    assert not connection.open
+    assert (pool.size, pool.discarded) == (0, 1)
+    with pool.connection() as replacement:
+        assert replacement is not connection
+
+
+def test_idle_connection_is_pinged_and_reconnected():
+    pool = ConnectionPool(FakeConnection, max_size=1, ping_interval=0.01)
+    with pool.connection() as connection:
+        connection.stale = True
+    time.sleep(0.02)
+    with pool.connection():
+        pass
+    assert pool.reconnects == 1
+
+
+def test_threads_share_the_pool():
+    pool = ConnectionPool(FakeConnection, max_size=3)
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with pool.connection():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 3
+    assert pool.size == 3
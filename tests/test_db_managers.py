@@ -0,0 +1,289 @@
+"""
+Both database managers behind create_db_manager, run against the same
+in-memory stand-in for MySQL: a fake pymysql connection for the threaded
+manager and a fake aiomysql pool for the native one.
+"""
+
+import asyncio
+import contextlib
+import itertools
+import types
+
+import pymysql
+import pytest
+from pymysql.constants.SERVER_STATUS import SERVER_STATUS_AUTOCOMMIT, SERVER_STATUS_IN_TRANS
+
+from db_manager import async_db_manager
+
+
+class FakeDatabase:
+    """Understands exactly the statements DBManager and AsyncDBManager send."""
+
+    def __init__(self, domains=(), reachable=True):
+        self.reachable = reachable
+        self.ids = itertools.count(1)
+        self.domains = {domain: next(self.ids) for domain in domains}
+        self.rows = {'domains_ip': [], 'domains_ns': []}
+        # Domains another connection inserts and commits in the middle of our next multi-row INSERT
+        self.racing_domains = set()
+        self.since_savepoint = []
+
+    def execute(self, sql, args):
+        """:return: Tuple (result rows as dicts, rowcount, lastrowid)."""
+        sql = ' '.join(sql.split())
+        if sql == 'SAVEPOINT insert_chunk':
+            self.since_savepoint = []
+            return [], 0, None
+        if sql == 'ROLLBACK TO SAVEPOINT insert_chunk':
+            for domain in self.since_savepoint:
+                del self.domains[domain]
+            self.since_savepoint = []
+            return [], 0, None
+        if sql.startswith('SELECT domain FROM domains WHERE'):
+            return [{'domain': domain} for domain in args if domain in self.domains], 0, None
+        if sql == 'SELECT domain FROM domains':
+            return [{'domain': domain} for domain in self.domains], 0, None
+        if sql.startswith('INSERT IGNORE INTO domains'):
+            new = []
+            for domain in args:
+                if domain in self.domains:
+                    continue
+                if new and domain in self.racing_domains:
+                    # Committed by the other connection first, ignored by ours
+                    self.racing_domains.discard(domain)
+                    self.domains[domain] = next(self.ids)
+                    continue
+                self.domains[domain] = next(self.ids)
+                new.append(domain)
+            self.since_savepoint.extend(new)
+            return [], len(new), self.domains[new[0]] if new else 0
+        if sql.startswith('SELECT id, domain FROM domains'):
+            *domains, first_id = args
+            return [{'id': self.domains[d], 'domain': d} for d in domains if self.domains[d] >= first_id], 0, None
+        if sql.startswith('INSERT INTO domains_'):
+            table = sql.split()[2]
+            self.rows[table].extend(zip(args[::2], args[1::2]))
+            return [], len(args) // 2, None
+        raise AssertionError(f"Unexpected statement: {sql}")
+
+
+class FakeCursor:
+    def __init__(self, database, tuples=False):
+        self.database = database
+        self.tuples = tuples
+        self.rows = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def _execute(self, sql, args=None):
+        self.rows, self.rowcount, self.lastrowid = self.database.execute(sql, list(args or ()))
+        if self.tuples:
+            self.rows = [tuple(row.values()) for row in self.rows]
+
+    def _fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeSyncCursor(FakeCursor):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql, args=None):
+        self._execute(sql, args)
+
+    def executemany(self, sql, data):
+        self._execute(sql.replace('(%s, %s)', ', '.join(['(%s, %s)'] * len(data))), [v for row in data for v in row])
+
+    def fetchall(self):
+        return self._fetchmany(len(self.rows))
+
+    def fetchmany(self, size):
+        return self._fetchmany(size)
+
+
+class FakeAsyncCursor(FakeCursor):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, sql, args=None):
+        self._execute(sql, args)
+
+    async def executemany(self, sql, data):
+        FakeSyncCursor.executemany(self, sql, data)
+
+    async def fetchall(self):
+        return self._fetchmany(len(self.rows))
+
+    async def fetchmany(self, size):
+        return self._fetchmany(size)
+
+
+class FakePymysqlConnection:
+    def __init__(self, database):
+        self.database = database
+        self.server_status = SERVER_STATUS_AUTOCOMMIT
+        self.open = True
+
+    def cursor(self, cursor_class=None):
+        return FakeSyncCursor(self.database, tuples=cursor_class is pymysql.cursors.SSCursor)
+
+    def begin(self):
+        self.server_status |= SERVER_STATUS_IN_TRANS
+
+    def commit(self):
+        self.server_status &= ~SERVER_STATUS_IN_TRANS
+
+    rollback = commit
+
+    def thread_id(self):
+        return 1
+
+    def ping(self, reconnect=True):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+class FakeAiomysqlConnection:
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self, cursor_class=None):
+        return FakeAsyncCursor(self.database, tuples=cursor_class is FAKE_AIOMYSQL.SSCursor)
+
+    async def begin(self):
+        pass
+
+    async def commit(self):
+        pass
+
+
+class FakeAiomysqlPool:
+    def __init__(self, database, maxsize):
+        self.database = database
+        self.size = self.freesize = self.maxsize = maxsize
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield FakeAiomysqlConnection(self.database)
+
+    def close(self):
+        self.size = 0
+
+    async def wait_closed(self):
+        pass
+
+
+FAKE_AIOMYSQL = types.SimpleNamespace(DictCursor=object(), SSCursor=object(), create_pool=None)
+
+
+@pytest.fixture(params=['pymysql', 'aiomysql'])
+def make_db_manager(request, monkeypatch):
+    """Returns a factory FakeDatabase -> db manager from create_db_manager."""
+    for name, value in {'DB_PORT': '3306', 'DB_TABLE_DOMAINS': 'domains', 'DB_TABLE_IPS': 'domains_ip',
+                        'DB_TABLE_NS': 'domains_ns', 'DB_POOL_SIZE': '2'}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(async_db_manager, 'aiomysql', FAKE_AIOMYSQL)
+
+    def make(database):
+        def connect():
+            if not database.reachable:
+                raise pymysql.OperationalError(2003, "Can't connect to MySQL server")
+
+        db_manager = async_db_manager.create_db_manager(request.param)
+        if request.param == 'pymysql':
+            def connect_pymysql():
+                connect()
+                return FakePymysqlConnection(database)
+            db_manager.db_manager._connect = connect_pymysql
+        else:
+            async def create_pool(**kwargs):
+                connect()
+                return FakeAiomysqlPool(database, kwargs['maxsize'])
+            monkeypatch.setattr(FAKE_AIOMYSQL, 'create_pool', create_pool)
+        return db_manager
+
+    make.driver = request.param
+    return make
+
+
+def test_create_db_manager_picks_the_driver(make_db_manager):
+    expected = {'pymysql': async_db_manager.ThreadedDBManager, 'aiomysql': async_db_manager.AsyncDBManager}
+    assert isinstance(make_db_manager(FakeDatabase()), expected[make_db_manager.driver])
+
+
+def test_create_db_manager_rejects_unknown_driver():
+    with pytest.raises(ValueError):
+        async_db_manager.create_db_manager('sqlite')
+
+
+def test_queries_and_inserts(make_db_manager):
+    database = FakeDatabase(['known.com'])
+
+    async def test():
+        db_manager = make_db_manager(database)
+        await db_manager.init_connection()
+        assert await db_manager.find_duplicates(['known.com', 'new.com']) == [True, False]
+        inserted = await db_manager.insert_non_duplicates(['known.com', 'new.com', 'new.com'])
+        assert inserted == {'new.com': database.domains['new.com']}
+        assert [domain async for domain in db_manager.iter_domains(batch_size=1)] == ['known.com', 'new.com']
+
+        assert await db_manager.insert_enrichment([(2, '192.0.2.1')], [(2, 'ns1.new.com')]) is True
+        await db_manager.insert_domains_ip([(1, '192.0.2.2')])
+        await db_manager.insert_domains_ns([(1, 'ns1.known.com')])
+        assert database.rows == {
+            'domains_ip': [(2, '192.0.2.1'), (1, '192.0.2.2')],
+            'domains_ns': [(2, 'ns1.new.com'), (1, 'ns1.known.com')],
+        }
+        assert db_manager.stats()['pool_max_size'] == 2
+        await db_manager.close_connection()
+    asyncio.run(test())
+
+
+def test_domains_committed_by_another_connection_are_not_claimed(make_db_manager):
+    database = FakeDatabase(['known.com'])
+    database.racing_domains = {'b.com'}
+
+    async def test():
+        db_manager = make_db_manager(database)
+        await db_manager.init_connection()
+        inserted = await db_manager.insert_non_duplicates(['a.com', 'known.com', 'b.com', 'c.com'])
+        # b.com got an id between the chunk's own rows, but it was not inserted by this call
+        assert inserted == {'a.com': database.domains['a.com'], 'c.com': database.domains['c.com']}
+        assert 'b.com' in database.domains
+    asyncio.run(test())
+
+
+def test_unreachable_database_is_reported_not_raised(make_db_manager):
+    async def test():
+        db_manager = make_db_manager(FakeDatabase(reachable=False))
+        await db_manager.init_connection()
+        assert await db_manager.find_duplicates(['a.com', 'b.com']) == [False, False]
+        assert await db_manager.insert_non_duplicates(['a.com']) is None
+        assert await db_manager.insert_enrichment([(1, '192.0.2.1')], []) is False
+        await db_manager.insert_domains_ip([(1, '192.0.2.1')])
+        await db_manager.insert_domains_ns([(1, 'ns1.a.com')])
+        # A scan that cannot finish must not look like an empty table
+        with pytest.raises(pymysql.MySQLError):
+            async for _domain in db_manager.iter_domains():
+                pass
+    asyncio.run(test())
+
+
+def test_pool_is_created_once_the_database_comes_back(make_db_manager):
+    database = FakeDatabase(['known.com'], reachable=False)
+
+    async def test():
+        db_manager = make_db_manager(database)
+        await db_manager.init_connection()
+        database.reachable = True
+        assert await db_manager.find_duplicates(['known.com']) == [True]
+    asyncio.run(test())
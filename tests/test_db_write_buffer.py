@@ -0,0 +1,50 @@
+import asyncio
+
+from d_storage_distribution.db_write_buffer import DBWriteBuffer
+
+
+class FakeDBManager:
+    def __init__(self, committed=True):
+        self.committed = committed
+        self.writes = []
+
+    async def insert_enrichment(self, ip_data, ns_data):
+        await asyncio.sleep(0.01)
+        self.writes.append((ip_data, ns_data))
+        return self.committed
+
+
+def test_commit_future_resolves_after_the_flush_holding_the_rows():
+    async def test():
+        db_manager = FakeDBManager()
+        buffer = DBWriteBuffer(db_manager, flush_rows=100, flush_interval=0.05, max_rows=1000)
+        await buffer.start()
+        first = await buffer.add([(1, '192.0.2.1')], [(1, 'ns1.example.com')])
+        second = await buffer.add([(2, '192.0.2.2')], [])
+        assert first is second
+        assert not first.done() and db_manager.writes == []
+        assert await asyncio.wait_for(first, 1) is True
+        assert db_manager.writes == [([(1, '192.0.2.1'), (2, '192.0.2.2')], [(1, 'ns1.example.com')])]
+
+        third = await buffer.add([(3, '192.0.2.3')], [])
+        assert third is not first and not third.done()
+        await buffer.close()
+        assert third.result() is True
+    asyncio.run(test())
+
+
+def test_commit_future_reports_a_failed_commit():
+    async def test():
+        buffer = DBWriteBuffer(FakeDBManager(committed=False), flush_rows=1, flush_interval=10, max_rows=1000)
+        commit_future = await buffer.add([(1, '192.0.2.1')], [])
+        assert await asyncio.wait_for(commit_future, 1) is False
+        assert buffer.rows_failed == 1
+    asyncio.run(test())
+
+
+def test_batch_without_rows_does_not_wait_for_a_flush():
+    async def test():
+        buffer = DBWriteBuffer(FakeDBManager(), flush_rows=100, flush_interval=10, max_rows=1000)
+        commit_future = await buffer.add([], [])
+        assert commit_future.done() and commit_future.result() is True
+    asyncio.run(test())
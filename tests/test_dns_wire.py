@@ -0,0 +1,74 @@
+import struct
+
+import pytest
+
+from c_dns_multiplexer.dns_wire import (
+    RCODE_NXDOMAIN, DNSWireError, decode_response, encode_name, encode_query, query_id_of,
+)
+from tests.fake_dns_server import a_record
+
+_HEADER = struct.Struct('!HHHHHH')
+
+
+def response(answers=(), authority=(), flags=0x8180, question_name='example.com'):
+    question = encode_name(question_name) + struct.pack('!HH', 1, 1)
+    return (
+        _HEADER.pack(0x1234, flags, 1, len(answers), len(authority), 0)
+        + question + b''.join(answers) + b''.join(authority)
+    )
+
+
+def record(owner, record_type, rdata, ttl=3600):
+    return owner + struct.pack('!HHIH', record_type, 1, ttl, len(rdata)) + rdata
+
+
+def test_encode_query_layout():
+    message = encode_query('example.com', 'NS', query_id=0xBEEF)
+    assert query_id_of(message) == 0xBEEF
+    assert _HEADER.unpack_from(message, 0) == (0xBEEF, 0x0100, 1, 0, 0, 0)
+    assert message[12:] == b'\x07example\x03com\x00' + struct.pack('!HH', 2, 1)
+
+
+def test_encode_name_rejects_long_label():
+    with pytest.raises(DNSWireError):
+        encode_name('a' * 64 + '.com')
+
+
+def test_decode_a_record_through_compression_pointer():
+    decoded = decode_response(response([a_record('192.0.2.1')]))
+    assert decoded == {
+        'Status': 0,
+        'TC': False,
+        'Answer': [{'name': 'example.com.', 'type': 1, 'TTL': 300, 'data': '192.0.2.1'}],
+    }
+
+
+def test_decode_ns_rdata_with_pointer_into_rdata_name():
+    # ns1.example.com encoded as 'ns1' + pointer to 'example.com' in the question
+    answers = [record(b'\xc0\x0c', 2, b'\x03ns1\xc0\x0c'), record(b'\xc0\x0c', 2, b'\x03ns2\xc0\x0c')]
+    decoded = decode_response(response(answers))
+    assert [answer['data'] for answer in decoded['Answer']] == ['ns1.example.com.', 'ns2.example.com.']
+
+
+def test_decode_soa_in_authority():
+    rdata = b'\x03ns1\xc0\x0c' + b'\x0ahostmaster\xc0\x0c' + struct.pack('!IIIII', 1, 7200, 900, 1209600, 300)
+    decoded = decode_response(response(authority=[record(b'\xc0\x0c', 6, rdata)], flags=0x8183))
+    assert decoded['Status'] == RCODE_NXDOMAIN
+    assert 'Answer' not in decoded
+    assert decoded['Authority'][0]['data'] == 'ns1.example.com. hostmaster.example.com. 1 7200 900 1209600 300'
+
+
+def test_decode_truncated_flag():
+    assert decode_response(response(flags=0x8380))['TC'] is True
+
+
+@pytest.mark.parametrize('message', [
+    b'\x12\x34\x81',                                                   # Shorter than a header
+    response([a_record('192.0.2.1')])[:-2],                             # Record data out of bounds
+    response([b'\xc0\x0c\x00']),                                        # Record header out of bounds
+    response([b'\xc0'], question_name='example.com'),                   # Pointer out of bounds
+    response([record(b'\xc0\x1d', 1, b'\x00' * 4)])[:29] + b'\xc0\x1d',  # Pointer loop
+])
+def test_decode_malformed_raises(message):
+    with pytest.raises(DNSWireError):
+        decode_response(message)
@@ -0,0 +1,127 @@
+import asyncio
+
+import h2.config
+import h2.connection
+import h2.events
+import h2.settings
+import pytest
+
+from c_dns_multiplexer.http2_client import HTTP2Connection
+from c_dns_multiplexer.resolver_backends import DNSQueryError, DoHWireBackend
+
+
+class FakeH2Server:
+    """
+    Cleartext HTTP/2 server allowing 2 concurrent streams.
+    The x-delay request header delays the reply (seconds), x-hang never replies.
+    """
+
+    def __init__(self):
+        self.resets = 0
+        self.requests = 0
+        self.server = None
+
+    async def start(self, port=0):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        connection.initiate_connection()
+        connection.update_settings({h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: 2})
+        writer.write(connection.data_to_send())
+        while data := await reader.read(65536):
+            for event in connection.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    self.requests += 1
+                    headers = dict(event.headers)
+                    if b'x-hang' not in headers:
+                        delay = float(headers.get(b'x-delay', b'0'))
+                        asyncio.get_running_loop().call_later(delay, self._reply, connection, writer, event.stream_id)
+                elif isinstance(event, h2.events.StreamReset):
+                    self.resets += 1
+            writer.write(connection.data_to_send())
+        writer.close()
+
+    @staticmethod
+    def _reply(connection, writer, stream_id):
+        if stream_id not in connection.streams or connection.streams[stream_id].closed:
+            return
+        connection.send_headers(stream_id, [(':status', '200')])
+        connection.send_data(stream_id, b'ok', end_stream=True)
+        writer.write(connection.data_to_send())
+
+
+async def with_connection(test):
+    server = await FakeH2Server().start()
+    connection = HTTP2Connection(f'http://127.0.0.1:{server.port}/dns-query', max_streams=100)
+    try:
+        return await test(connection, server)
+    finally:
+        await connection.close()
+        await server.close()
+
+
+def test_abandoned_streams_are_reset_and_do_not_block_the_connection():
+    async def test(connection, server):
+        for _ in range(3):
+            try:
+                await asyncio.wait_for(connection.request(b'GET', [(b'x-hang', b'1')]), 0.1)
+            except asyncio.TimeoutError:
+                pass
+        status, body = await asyncio.wait_for(connection.request(b'GET', []), 1)
+        assert (status, body) == (200, b'ok')
+        await asyncio.sleep(0.05)
+        assert server.resets == 3
+        assert connection.connection.open_outbound_streams == 0
+    asyncio.run(with_connection(test))
+
+
+def test_cancelled_request_is_reset():
+    async def test(connection, server):
+        task = asyncio.create_task(connection.request(b'GET', [(b'x-hang', b'1')]))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.05)
+        assert server.resets == 1
+    asyncio.run(with_connection(test))
+
+
+def test_requests_beyond_server_stream_limit_wait_for_a_free_stream():
+    async def test(connection, server):
+        await connection.connect()
+        await asyncio.sleep(0.05)  # Let the server SETTINGS arrive
+        results = await asyncio.wait_for(
+            asyncio.gather(*(connection.request(b'GET', [(b'x-delay', b'0.05')]) for _ in range(5))), 2
+        )
+        assert results == [(200, b'ok')] * 5
+        assert server.requests == 5
+    asyncio.run(with_connection(test))
+
+
+def test_doh_wire_backend_starts_with_an_unreachable_upstream():
+    async def test():
+        server = await FakeH2Server().start()
+        port = server.port
+        await server.close()  # Nothing listens on the port any more
+
+        backend = DoHWireBackend(f'http://127.0.0.1:{port}/dns-query', connections=2, timeout=1)
+        await backend.start()
+        try:
+            with pytest.raises(DNSQueryError):
+                await backend.query('example.com', 'A')
+
+            # Once the upstream is back, requests reconnect on their own
+            server = await FakeH2Server().start(port)
+            status, body = await asyncio.wait_for(backend.connections[0].request(b'GET', []), 1)
+            assert (status, body) == (200, b'ok')
+            await server.close()
+        finally:
+            await backend.close()
+    asyncio.run(test())
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+import pulsar
+
+from pulsar_producer import pulsar_producer
+from pulsar_producer.pulsar_producer import PulsarProducer
+
+
+class FakeProducer:
+    # Acknowledges messages from another thread once ack() is called, like the client's callbacks
+    def __init__(self):
+        self.callbacks = []
+
+    def send_async(self, content, callback):
+        self.callbacks.append(callback)
+
+    def ack(self):
+        callbacks, self.callbacks = self.callbacks, []
+        thread = threading.Thread(target=lambda: [callback(pulsar.Result.Ok, 'id') for callback in callbacks])
+        thread.start()
+        thread.join()
+
+    def flush(self):
+        pass
+
+
+class FakeClient:
+    def __init__(self, url):
+        self.url = url
+
+    def create_producer(self, topic, **kwargs):
+        return FakeProducer()
+
+
+def test_producer_built_before_the_loop_limits_unacked_messages(monkeypatch):
+    monkeypatch.setattr(pulsar_producer.pulsar, 'Client', FakeClient)
+    monkeypatch.setenv('PULSAR_MAX_PENDING', '2')
+    monkeypatch.setenv('PULSAR_MESSAGE_FORMAT', 'json')
+    # Built at import time in main.py, outside any running loop
+    producer = PulsarProducer()
+
+    async def test():
+        first = await producer.send_async('a')
+        await producer.send_async('b')
+        third = asyncio.create_task(producer.send_async('c'))
+        await asyncio.sleep(0.05)
+        assert not third.done()  # The window of 2 unacknowledged messages is full
+
+        producer.producer.ack()
+        assert await first == 'id'
+        await asyncio.wait_for(third, 1)
+        assert producer.sent == 3
+        assert producer.acked == 2
+        producer.producer.ack()
+        await producer.flush()
+        assert producer.acked == 3
+    asyncio.run(test())
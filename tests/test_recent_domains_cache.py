@@ -0,0 +1,47 @@
+from b_certs_filtering import recent_domains_cache
+from b_certs_filtering.recent_domains_cache import RecentDomainsCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(monkeypatch, **kwargs):
+    clock = FakeClock()
+    monkeypatch.setattr(recent_domains_cache.time, 'monotonic', clock)
+    return RecentDomainsCache(**kwargs), clock
+
+
+def test_repeats_are_dropped_until_the_ttl_expires(monkeypatch):
+    cache, clock = make_cache(monkeypatch, max_size=10, ttl=60)
+    assert cache.filter_unseen(['a.com', 'b.com', 'a.com']) == ['a.com', 'b.com']
+    clock.now += 59
+    assert cache.filter_unseen(['a.com', 'c.com']) == ['c.com']
+
+    # Seeing a domain again extends its window
+    clock.now += 59
+    assert cache.filter_unseen(['a.com', 'b.com']) == ['b.com']
+    assert cache.hits == 3
+    assert cache.misses == 4
+    assert cache.hit_rate == 3 / 7
+
+
+def test_least_recently_seen_domain_is_evicted(monkeypatch):
+    cache, _clock = make_cache(monkeypatch, max_size=2, ttl=60)
+    cache.filter_unseen(['a.com', 'b.com'])
+    cache.seen('a.com')  # b.com is now the least recently seen
+    cache.seen('c.com')
+    assert len(cache) == 2
+    assert list(cache.entries) == ['a.com', 'c.com']
+    assert cache.filter_unseen(['b.com']) == ['b.com']
+
+
+def test_forgotten_domains_are_processed_again(monkeypatch):
+    cache, _clock = make_cache(monkeypatch, max_size=10, ttl=60)
+    cache.filter_unseen(['a.com', 'b.com'])
+    cache.forget(['a.com', 'unknown.com'])
+    assert cache.filter_unseen(['a.com', 'b.com']) == ['a.com']
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from c_dns_multiplexer.resolver_backends import DNSQueryError, UDPResolverBackend
+from tests.fake_dns_server import FakeDNSServer
+
+
+async def with_backend(test):
+    server = await FakeDNSServer().start()
+    backend = UDPResolverBackend(server.host, server.port, timeout=1.0)
+    await backend.start()
+    try:
+        return await test(backend, server)
+    finally:
+        await backend.close()
+        await server.close()
+
+
+def test_noerror_answer():
+    async def test(backend, server):
+        response = await backend.query('example.com', 'A')
+        assert response['Status'] == 0
+        assert response['Answer'] == [{'name': 'example.com.', 'type': 1, 'TTL': 300, 'data': '192.0.2.1'}]
+    asyncio.run(with_backend(test))
+
+
+def test_nxdomain():
+    async def test(backend, server):
+        response = await backend.query('nx.example.com', 'A')
+        assert response['Status'] == 3
+        assert 'Answer' not in response
+    asyncio.run(with_backend(test))
+
+
+def test_concurrent_replies_are_routed_by_message_id():
+    async def test(backend, server):
+        names = [f'host{i}.example.com' for i in range(200)]
+        responses = await asyncio.gather(*(backend.query(name, 'A') for name in names))
+        assert [response['Answer'][0]['name'] for response in responses] == [name + '.' for name in names]
+        assert backend.pending == {}
+    asyncio.run(with_backend(test))
+
+
+def test_truncated_answer_falls_back_to_tcp():
+    async def test(backend, server):
+        response = await backend.query('big.example.com', 'A')
+        assert response['TC'] is False
+        assert len(response['Answer']) == 60
+        assert server.tcp_queries == 1
+    asyncio.run(with_backend(test))
+
+
+def test_malformed_reply_is_not_retryable():
+    async def test(backend, server):
+        with pytest.raises(DNSQueryError) as excinfo:
+            await backend.query('bad.example.com', 'A')
+        assert excinfo.value.retryable is False
+    asyncio.run(with_backend(test))
+
+
+def test_unanswered_query_times_out():
+    async def test():
+        loop = asyncio.get_running_loop()
+        silent, _protocol = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, local_addr=('127.0.0.1', 0))
+        backend = UDPResolverBackend('127.0.0.1', silent.get_extra_info('sockname')[1], timeout=0.2)
+        await backend.start()
+        try:
+            with pytest.raises(DNSQueryError) as excinfo:
+                await backend.query('example.com', 'A')
+            assert excinfo.value.retryable is True
+            assert backend.pending == {}
+        finally:
+            await backend.close()
+            silent.close()
+    asyncio.run(test())
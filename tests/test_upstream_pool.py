@@ -0,0 +1,23 @@
+from c_dns_multiplexer.resolver_backends import DNSResolverBackend
+from c_dns_multiplexer.upstream_pool import UpstreamPool
+
+
+class NamedBackend(DNSResolverBackend):
+    def __init__(self, name):
+        self.name = name
+
+
+def test_hedge_delay_refreshes_every_50_samples_once_the_window_is_full():
+    pool = UpstreamPool([NamedBackend('a'), NamedBackend('b')], latency_window=500, max_hedge_delay=10.0)
+    upstream = pool.upstreams[0]
+    for _ in range(500):
+        pool._record(upstream, 0.1)
+    assert pool.hedge_delay == 0.1
+
+    # 49 slow samples are enough to move p95 of the window, but the hedge
+    # delay is only refreshed on the 50th
+    for _ in range(49):
+        pool._record(upstream, 5.0)
+    assert pool.hedge_delay == 0.1
+    pool._record(upstream, 5.0)
+    assert pool.hedge_delay == 5.0